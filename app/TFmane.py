@@ -10,24 +10,132 @@ import numpy as np
 import time
 import threading
 import queue
+import os
+import glob
+import re
+import struct
+from collections import OrderedDict
 # import importlib.util
 from loguru import logger
 from vidgear.gears import CamGear
 if platform.system() != 'Linux':
     from pygrabber.dshow_graph import FilterGraph
+else:
+    import fcntl
 system_info = platform.system()
 if system_info == 'Linux':
     logger.info("Detected Linux system | Now using tflite_runtime")
     from tflite_runtime.interpreter import Interpreter
+    from tflite_runtime.interpreter import load_delegate
+    try:
+        from tflite_runtime.interpreter import OpResolverType
+    except ImportError:
+        OpResolverType = None
 else: 
     logger.info("Detected non-Linux system | Now using tensorflow.lite")
     from tensorflow.lite.python.interpreter import Interpreter
+    from tensorflow.lite.python.interpreter import load_delegate
+    try:
+        from tensorflow.lite.python.interpreter import OpResolverType
+    except ImportError:
+        OpResolverType = None
+
+
+def createInterpreter(model_path, options=None):
+    # options come from "interpreter" in models/<name>/config.json, example:
+    # "interpreter": {"num_threads": 4, "xnnpack": true, "delegate": "libedgetpu.so.1"}
+    options = options or {}
+    kwargs = {}
+    if options.get("num_threads") is not None:
+        kwargs["num_threads"] = int(options["num_threads"])
+    if options.get("delegate"):
+        kwargs["experimental_delegates"] = [load_delegate(options["delegate"])]
+    if options.get("xnnpack") == False:
+        # XNNPACK is the default delegate of recent TFLite, only the builtin kernels when disabled
+        if OpResolverType is not None:
+            kwargs["experimental_op_resolver_type"] = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        else:
+            logger.warning("[TFMaid] This TFLite version can not disable XNNPACK, ignore the option")
+    interpreter = Interpreter(model_path=model_path, **kwargs)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+# Upper bounds of /model/{name}/benchmark, it run on the same CPU as the live detection
+BENCHMARK_MAX_RUNS = 200
+BENCHMARK_MAX_WARMUP = 20
+BENCHMARK_MAX_THREADS = os.cpu_count() or 4
+
+
+# V4L2 VIDIOC_QUERYCAP = _IOR('V', 0, struct v4l2_capability) (104 bytes)
+VIDIOC_QUERYCAP = 0x80685600
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+# Camera list shared by every TFMane, only scanned again when /dev/video* change (hotplug) or on rescan
+camera_cache = {
+    "devices": None,
+    "camera_id": [],
+    "camera_name": [],
+    "scan_time": 0,
+}
+
+
+def queryV4L2Camera(path):
+    # Ask the driver what the device is, return the camera name or None if it can not capture video
+    # (UVC cameras also create metadata nodes that can not be opened by VideoCapture)
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError as e:
+        logger.warning("Can not open {}: {}".format(path, e))
+        return None
+    try:
+        buffer = bytearray(104)
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, buffer)
+    except OSError as e:
+        logger.warning("{} is not a V4L2 device: {}".format(path, e))
+        return None
+    finally:
+        os.close(fd)
+    driver, card, bus_info, version, capabilities, device_caps = struct.unpack_from("16s32s32sIII", buffer)
+    if capabilities & V4L2_CAP_DEVICE_CAPS:
+        capabilities = device_caps
+    if not capabilities & V4L2_CAP_VIDEO_CAPTURE:
+        return None
+    return card.split(b"\0", 1)[0].decode(errors="replace")
+
+
+def listV4L2Cameras(force=False):
+    # Return (camera_id, camera_name) from /dev/video*, cached until a device is plugged or unplugged
+    # Sort by number so /dev/video10 come after /dev/video2
+    devices = sorted(glob.glob("/dev/video*"), key=lambda path: (len(path), path))
+    if not force and camera_cache["devices"] == devices:
+        return camera_cache["camera_id"], camera_cache["camera_name"]
+    t1 = time.perf_counter()
+    available_cameras_id = []
+    available_cameras_name = []
+    for path in devices:
+        match = re.match(r"/dev/video(\d+)$", path)
+        if not match:
+            continue
+        name = queryV4L2Camera(path)
+        if name is None:
+            continue
+        available_cameras_id.append(int(match.group(1)))
+        available_cameras_name.append(name)
+        logger.success("Camera index {} ({}) is available".format(match.group(1), name))
+    camera_cache["devices"] = devices
+    camera_cache["camera_id"] = available_cameras_id
+    camera_cache["camera_name"] = available_cameras_name
+    camera_cache["scan_time"] = time.perf_counter() - t1
+    logger.info("Scanned {} video devices in {:.3f}s".format(len(devices), camera_cache["scan_time"]))
+    return available_cameras_id, available_cameras_name
 
 
 # Define VideoStream class to handle streaming of video from webcam in separate processing thread
 class VideoStream:
     """Camera object that controls video streaming from the Picamera"""
-    def __init__(self,resolution=(640,480),framerate=30,device=0):
+    def __init__(self,resolution=(640,480),framerate=30,device=0,buffer_size=4):
         # Initialize the PiCamera and the camera image stream
         # self.stream = cv2.VideoCapture(device)
         try:
@@ -36,15 +144,29 @@ class VideoStream:
             logger.info("Error when open camera: {}".format(e))
             self.stream = None
             return None
-            
+
+        # Ring of preallocated frame buffers, the capture thread copy into the next slot
+        # so readers never see a frame that is being written (as long as they finish within buffer_size frames)
+        self.buffer_size = buffer_size
+        self.buffers = None
+        self.views = None
+        self.lock = threading.Lock()
+        # Consumers wait on this condition until the capture thread store a newer frame
+        self.condition = threading.Condition(self.lock)
+        # How long the capture thread rest when the camera has no new frame yet (half of a frame period)
+        self.idle_wait = 0.5 / framerate if framerate else 0.01
+        self.frame_id = 0
+        self.frame = None
+
         # Read first frame from the stream
-        self.frame = self.stream.read()
+        self.store(self.stream.read())
 
 	    # Variable to control when the camera is stopped
         self.stopped = False
 
     def __del__(self):
-        self.stream.stop()
+        if self.stream is not None:
+            self.stream.stop()
         logger.info("[TFMaid] Detect that video is running,  So now It's been closed")
 
     def start(self):
@@ -52,7 +174,31 @@ class VideoStream:
         threading.Thread(target=self.update,args=()).start()
         return self
 
+    def allocate(self, frame):
+        self.buffers = [np.empty_like(frame) for i in range(self.buffer_size)]
+        self.views = []
+        for buffer in self.buffers:
+            # Consumers get a read-only view, draw on a copy instead
+            view = buffer.view()
+            view.flags.writeable = False
+            self.views.append(view)
+
+    def store(self, currentframe):
+        if currentframe is None:
+            return False
+        if self.buffers is None or self.buffers[0].shape != currentframe.shape or self.buffers[0].dtype != currentframe.dtype:
+            self.allocate(currentframe)
+        # Write into the slot after the latest one, no allocation per frame
+        slot = (self.frame_id + 1) % self.buffer_size
+        np.copyto(self.buffers[slot], currentframe)
+        with self.condition:
+            self.frame_id += 1
+            self.frame = self.views[slot]
+            self.condition.notify_all()
+        return True
+
     def update(self):
+        last_frame = None
         # Keep looping indefinitely until the thread is stopped
         while True:
             # If the camera is stopped, stop the thread
@@ -63,9 +209,13 @@ class VideoStream:
 
             # Otherwise, grab the next frame from the stream
             currentframe = self.stream.read()
-
-            if currentframe is not None:
-                self.frame = currentframe.copy()
+            # CamGear can return nothing (or the same frame again) when the camera has no new frame yet,
+            # rest a bit instead of spinning the CPU
+            if currentframe is None or currentframe is last_frame:
+                time.sleep(self.idle_wait)
+                continue
+            last_frame = currentframe
+            self.store(currentframe)
             
     def stream(self):
         return self.stream
@@ -74,10 +224,134 @@ class VideoStream:
 	# Return the most recent frame
         return self.frame
 
+    def waitForFrame(self, after_id=None, timeout=None):
+        # Block until a frame newer than after_id is captured, return (frame_id, frame)
+        # Return (frame_id, None) when timeout or the camera is stopped
+        with self.condition:
+            if after_id is not None:
+                self.condition.wait_for(lambda: self.frame_id != after_id or self.stopped, timeout)
+                if self.frame_id == after_id:
+                    return self.frame_id, None
+            return self.frame_id, self.frame
+
     def stop(self):
 	# Indicate that the camera and thread should be stopped
-        self.stopped = True
+        with self.condition:
+            self.stopped = True
+            # Wake up every consumer that is waiting for a frame
+            self.condition.notify_all()
     
+class DetectStage:
+    """One stage of the detection pipeline, a worker thread that read a bounded queue"""
+    def __init__(self, name, work, output=None, maxsize=1, on_drop=None):
+        # on_drop(item) is called for every item dropped without being processed
+        self.name = name
+        self.work = work
+        self.output = output
+        self.on_drop = on_drop
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.latency = 0
+        self.processed = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, item):
+        # Keep the newest item, a stale frame is worth nothing to the next stage
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.drop(self.queue.get_nowait())
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def clear(self):
+        while True:
+            try:
+                self.drop(self.queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def drop(self, item):
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            t1 = time.perf_counter()
+            try:
+                result = self.work(item)
+            except Exception as e:
+                logger.info("[TFMaid] Error in {} stage: {}".format(self.name, e))
+                result = None
+            self.latency = 0.8 * self.latency + 0.2 * (time.perf_counter() - t1) if self.processed else time.perf_counter() - t1
+            self.processed += 1
+            if result is not None and self.output is not None:
+                self.output.put(result)
+
+    def getStatus(self):
+        return {
+            "queue": self.queue.qsize(),
+            "latency_ms": self.latency * 1000,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
+
+
+class ModelPool:
+    """LRU pool of loaded and warmed models, keyed by model folder and model file mtime"""
+    def __init__(self, budget_mb=256):
+        self.budget = budget_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.hits += 1
+                return self.models[key]["model"]
+            self.misses += 1
+            return None
+
+    def put(self, key, model, size, pinned=None):
+        with self.lock:
+            # The model file changed on disk, the old interpreter of the same folder is useless now
+            for old_key in [old_key for old_key in self.models if old_key[0] == key[0] and old_key != key]:
+                del self.models[old_key]
+            self.models[key] = {"model": model, "size": size}
+            self.models.move_to_end(key)
+            # Evict the least recently used models until we are under budget, never the pinned (running) one
+            for old_key in list(self.models):
+                if self.usage() <= self.budget:
+                    break
+                if old_key == key or old_key == pinned:
+                    continue
+                logger.info("[TFMaid] Model pool over budget, unload {}".format(old_key[0]))
+                del self.models[old_key]
+
+    def usage(self):
+        return sum(entry["size"] for entry in self.models.values())
+
+    def getStatus(self):
+        with self.lock:
+            return {
+                "models": [key[0] for key in self.models],
+                "usage_mb": self.usage() / (1024 * 1024),
+                "budget_mb": self.budget / (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
 class TFMane:
     def __init__(self, sysmame):
 
@@ -85,6 +359,8 @@ class TFMane:
         self.model_config = self.sysmane.getCurrentModelConfig()
         self.model = self.model_config.get("model_file")
         self.labels = self.model_config.get("model_classes")
+        self.label_array = np.array(self.labels, dtype=object)
+        self.label_size_cache = {}
         
         self.system_info = None
         self.interpreter = None
@@ -106,13 +382,48 @@ class TFMane:
             "camera_running" : False,
             "current_camera" : 0,
             "fps" : 0,
+            "inference_time" : 0,
+            "latency" : 0,
+            "pipeline" : None,
+            "model_pool" : None,
+            "model_swap" : {
+                "state": "idle",
+                "model": None,
+                "load_time": 0,
+                "message": None,
+            },
+            "detect_mode" : None,
+            "target_fps" : 0,
             "box" : None,
+            "detections" : [],
             "alert":{
                 "camera_not_working": False,
                 "model_not_working": False
             }
         }
 
+        # Detection scheduler
+        self.detect_modes = ["max", "target_fps", "on_demand"]
+        self.detect_event = threading.Event()
+        self.interpreter_lock = threading.Lock()
+        # Held while the detect loop preprocess a frame, so a model swap never happen in the middle of it
+        self.swap_lock = threading.Lock()
+        # Only one benchmark at a time
+        self.benchmark_lock = threading.Lock()
+        self.model_generation = 0
+        self.model_name = self.sysmane.getCurrentModel()
+        self.model_key = None
+        # Loaded and warmed interpreters of recently used models
+        self.model_pool = ModelPool(float(self.sysmane.app_config.get("model_pool_mb") or 256))
+        self.detect_mode = "target_fps"
+        self.target_fps = 5.0
+        self.setDetectMode(self.sysmane.app_config.get("detect_mode") or "target_fps", float(self.sysmane.app_config.get("detect_target_fps") or 5))
+        self.last_publish = None
+        # Run capture, preprocess, infer and publish on separate threads
+        self.pipeline_enabled = str(self.sysmane.app_config.get("detect_pipeline")).lower() == "true"
+        self.infer_stage = None
+        self.publish_stage = None
+
         self.setup()
         self.setupDetect()
 
@@ -168,16 +479,65 @@ class TFMane:
             logger.info("[TFMaid] Detect that camera is not ready,  Can't setup model")
             return False
         
-        self.interpreter = Interpreter(model_path=self.sysmane.getFullModelPath(self.sysmane.getCurrentModel()))
-        self.interpreter.allocate_tensors()
-        
+        self.applyModel(self.loadModel(self.sysmane.getCurrentModel()))
+
+    def loadModel(self, model_name, warm_runs=1):
+        # Build and warm a new interpreter without touching the running one
+        # A recently used model come from the pool, so switching back is instant
+        model_path = self.sysmane.getFullModelPath(model_name)
+        key = (model_name, os.path.getmtime(model_path))
+        model = self.model_pool.get(key)
+        if model is not None:
+            logger.info("[TFMaid] Model {} found in the pool".format(model_name))
+            return model
+
+        model_config = self.sysmane.getModelConfig(model_name)
+        interpreter = createInterpreter(model_path, model_config.get("interpreter"))
+        input_details = interpreter.get_input_details()
+        # Test invoke, so a broken model fail here and the first real frame does not pay the warm up
+        interpreter.set_tensor(input_details[0]['index'], np.zeros(input_details[0]['shape'], dtype=input_details[0]['dtype']))
+        for i in range(warm_runs):
+            interpreter.invoke()
+        model = {
+            "name": model_name,
+            "key": key,
+            "config": model_config,
+            "interpreter": interpreter,
+        }
+        self.model_pool.put(key, model, self.estimateModelSize(model_path, interpreter), pinned=self.model_key)
+        self.current_status['model_pool'] = self.model_pool.getStatus()
+        return model
+
+    def estimateModelSize(self, model_path, interpreter):
+        # Every tensor once: the constant ones are the weights (mapped from the model file, so the file is not
+        # counted again), the others live in the arena. Fallback to the file size if the details are empty
+        size = 0
+        for detail in interpreter.get_tensor_details():
+            size += int(np.prod(detail['shape'])) * np.dtype(detail['dtype']).itemsize
+        return size or os.path.getsize(model_path)
+
+    def applyModel(self, model):
+        # Switch every model dependent attribute to the loaded model, call with swap_lock and interpreter_lock held
+        # (or before the detection start)
+        self.model_name = model["name"]
+        self.model_key = model["key"]
+        self.model_config = model["config"]
+        self.model = self.model_config.get("model_file")
+        self.labels = self.model_config.get("model_classes")
+        self.label_array = np.array(self.labels, dtype=object)
+        self.label_size_cache = {}
+        self.imageWidth = self.model_config.get("config","image_width")
+        self.imageHeight = self.model_config.get("config","image_height")
+        self.framerate = self.model_config.get("config","framerate")
+        self.interpreter = model["interpreter"]
+
         # Get model details
         self.input_details = self.interpreter.get_input_details()
         self.output_details = self.interpreter.get_output_details()
         self.height = self.input_details[0]['shape'][1]
         self.width = self.input_details[0]['shape'][2]
         self.floating_model = (self.input_details[0]['dtype'] == np.float32)
-        logger.info("Model loaded: {}".format(self.sysmane.getModelPath(self.sysmane.getCurrentModel())))
+        logger.info("Model loaded: {}".format(self.sysmane.getModelPath(self.model_name)))
         logger.info("Height: {} | Width: {}".format(self.height, self.width))
         # Check output layer name to determine if this model was created with TF2 or TF1,
         # because outputs are ordered differently for TF2 and TF1 models
@@ -188,6 +548,173 @@ class TFMane:
         else:
             self.boxes_idx, self.classes_idx, self.scores_idx = 0, 1, 2
 
+        self.setupPreprocess()
+        if self.pipeline_enabled:
+            if self.infer_stage is None:
+                self.setupPipeline()
+            else:
+                self.allocatePipelineBuffers()
+        self.model_generation += 1
+
+    def switchModel(self, model_name):
+        # Hot-swap the model: load and warm it in background, then swap between two frames
+        if self.current_status['model_swap']['state'] == "loading":
+            logger.warning("[TFMaid] Model {} is still loading".format(self.current_status['model_swap']['model']))
+            return False
+        self.current_status['model_swap'] = {
+            "state": "loading",
+            "model": model_name,
+            "load_time": 0,
+            "message": "Loading model {}".format(model_name),
+        }
+        swap_thread = threading.Thread(target=self.swapModel, args=(model_name,))
+        swap_thread.daemon = True
+        swap_thread.start()
+        return True
+
+    def swapModel(self, model_name):
+        t1 = time.perf_counter()
+        try:
+            model = self.loadModel(model_name, warm_runs=3)
+        except Exception as e:
+            logger.error("[TFMaid] Can not load model {}, keep using {}: {}".format(model_name, self.model_name, e))
+            self.current_status['model_swap']['state'] = "failed"
+            self.current_status['model_swap']['message'] = str(e)
+            return False
+        # Only wait for the frame in progress, the detection continue with the new model on the next frame
+        with self.swap_lock:
+            with self.interpreter_lock:
+                self.applyModel(model)
+        self.sysmane.setCurrentModel(model_name)
+        self.current_status['model_pool'] = self.model_pool.getStatus()
+        self.current_status['model_swap']['state'] = "ready"
+        self.current_status['model_swap']['load_time'] = time.perf_counter() - t1
+        self.current_status['model_swap']['message'] = "Model {} is running".format(model_name)
+        self.current_status['alert']['model_not_working'] = False
+        logger.success("[TFMaid] Switched to model {} in {:.2f}s".format(model_name, self.current_status['model_swap']['load_time']))
+        return True
+
+    def setupPreprocess(self):
+        # Resolve everything the per-frame preprocessing need once, and preallocate its buffers
+        self.min_conf_threshold = self.model_config.get("config","min_conf_threshold")
+        self.input_mean = float(self.model_config.get("config","input_mean"))
+        self.input_std = float(self.model_config.get("config","input_std"))
+        self.input_scale = 1.0 / self.input_std
+        self.input_index = self.input_details[0]['index']
+        # resized BGR frame -> RGB frame -> model input [1xHxWx3] (input_data is only used without zero-copy)
+        self.resized_buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.rgb_buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.input_data = np.empty(self.input_details[0]['shape'], dtype=self.input_details[0]['dtype'])
+
+        # Zero-copy access to the interpreter buffers, fallback to set_tensor/get_tensor if not supported
+        try:
+            self.input_tensor = self.interpreter.tensor(self.input_index)
+            self.output_tensors = [self.interpreter.tensor(detail['index']) for detail in self.output_details]
+            view = self.input_tensor()
+            if tuple(view.shape) != tuple(self.input_data.shape) or view.dtype != self.input_data.dtype:
+                raise ValueError("input tensor view has shape {} {}".format(view.shape, view.dtype))
+            del view
+            self.zero_copy = True
+        except Exception as e:
+            logger.warning("[TFMaid] Zero-copy tensor access not available, use set_tensor/get_tensor instead: {}".format(e))
+            self.input_tensor = None
+            self.output_tensors = None
+            self.zero_copy = False
+
+    def preprocess(self, frame, input_data, resized_buffer=None, rgb_buffer=None):
+        # Resize first (fewer pixels to convert), then convert to RGB straight into the input buffer
+        # The pipeline pass its own work buffers so it never share them with detectFrame
+        resized_buffer = self.resized_buffer if resized_buffer is None else resized_buffer
+        rgb_buffer = self.rgb_buffer if rgb_buffer is None else rgb_buffer
+        cv2.resize(frame, (self.width, self.height), dst=resized_buffer)
+        if self.floating_model:
+            cv2.cvtColor(resized_buffer, cv2.COLOR_BGR2RGB, dst=rgb_buffer)
+            # Normalize pixel values in place (float model, i.e. non-quantized)
+            np.subtract(rgb_buffer, self.input_mean, out=input_data[0], casting="unsafe")
+            np.multiply(input_data[0], self.input_scale, out=input_data[0])
+        else:
+            cv2.cvtColor(resized_buffer, cv2.COLOR_BGR2RGB, dst=input_data[0])
+        return input_data
+
+    def setupPipeline(self):
+        # capture (VideoStream) -> preprocess (detect loop) -> infer -> publish
+        # Each stage has its own thread and a bounded queue, so preprocessing frame N+1 overlap the inference of frame N
+        self.publish_stage = DetectStage("publish", self.publishStage)
+        self.infer_stage = DetectStage("infer", self.inferStage, output=self.publish_stage, on_drop=self.releasePipelineBuffer)
+        self.preprocess_latency = 0
+        self.allocatePipelineBuffers()
+
+    def allocatePipelineBuffers(self):
+        # Input buffers in flight: one queued, one being copied into the interpreter, one being written (+1 spare)
+        # A buffer is taken from the free list by the detect loop and given back once inferStage copied it,
+        # or when the item is dropped, so a queued item never see its input overwritten
+        self.pipeline_free = queue.Queue()
+        for i in range(4):
+            self.pipeline_free.put(np.empty(self.input_details[0]['shape'], dtype=self.input_details[0]['dtype']))
+        self.pipeline_resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.pipeline_rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def releasePipelineBuffer(self, item):
+        # Buffers of the model before the swap have the wrong shape, let them go
+        # Check the buffer itself, the generation is bumped only after applyModel reallocated the free list
+        buffer = item.get('input')
+        item['input'] = None
+        if buffer is None or item['generation'] != self.model_generation:
+            return
+        input_details = self.input_details[0]
+        if tuple(buffer.shape) == tuple(input_details['shape']) and buffer.dtype == input_details['dtype']:
+            self.pipeline_free.put(buffer)
+
+    def inferStage(self, item):
+        t1 = time.perf_counter()
+        with self.interpreter_lock:
+            if item['generation'] != self.model_generation:
+                # Preprocessed for the model before the swap, skip it
+                self.releasePipelineBuffer(item)
+                return None
+            try:
+                if self.zero_copy:
+                    input_view = self.input_tensor()
+                    np.copyto(input_view, item['input'])
+                    del input_view
+                else:
+                    self.interpreter.set_tensor(self.input_index, item['input'])
+            finally:
+                # The interpreter has its own copy now
+                self.releasePipelineBuffer(item)
+            self.interpreter.invoke()
+            item['detections'] = self.readDetections()
+        item['inference_time'] = time.perf_counter() - t1
+        del item['input']
+        return item
+
+    def publishStage(self, item):
+        if not self.current_status['detect_running'] or item['generation'] != self.model_generation:
+            return None
+        boxes, classes, scores = item['detections']
+        result = self.buildResult(boxes, classes, scores)
+        result['inference_time'] = item['inference_time']
+        self.updateThroughput()
+        self.current_status['latency'] = time.perf_counter() - item['start']
+        self.current_status['pipeline'] = self.getPipelineStatus()
+        self.publishResult(result)
+        return None
+
+    def getPipelineStatus(self):
+        return {
+            "preprocess": {"latency_ms": self.preprocess_latency * 1000},
+            "infer": self.infer_stage.getStatus(),
+            "publish": self.publish_stage.getStatus(),
+        }
+
+    def updateThroughput(self):
+        # fps is the real end-to-end throughput (time between two published results), not one invoke
+        now = time.perf_counter()
+        if self.last_publish is not None and now > self.last_publish:
+            frame_rate_calc = 1 / (now - self.last_publish)
+            self.current_status['fps'] = frame_rate_calc if self.current_status['fps'] == 0 else 0.8 * self.current_status['fps'] + 0.2 * frame_rate_calc
+        self.last_publish = now
+
     # When destroy the object, close the camera
     def __del__(self):
         if self.video is not None:
@@ -201,8 +728,14 @@ class TFMane:
 
     def stopDetect(self):
         self.current_status['detect_running'] = False
+        self.detect_event.clear()
+        if self.infer_stage is not None:
+            # Drop the frames still waiting in the pipeline
+            self.infer_stage.clear()
+            self.publish_stage.clear()
         self.current_status['detect_flag'] = False
         self.current_status['box'] = None
+        self.current_status['detections'] = []
         self.current_status['current_classes'] = ""
         self.current_status['confident_score'] = 0
         self.current_status['fps'] = 0
@@ -211,6 +744,7 @@ class TFMane:
 
     def startDetect(self):
         self.current_status['detect_running'] = True
+        self.detect_event.set()
     
     def setupDetect(self):
         detect_thread = threading.Thread(target=self.detect)
@@ -305,7 +839,18 @@ class TFMane:
     #     return arr
 
     # Return the camera ID and name
-    def checkAvaiableCamera(self):
+    def rescanCamera(self):
+        # Explicit refresh of the camera list (e.g. after plugging a camera)
+        self.camera_list, self.camera_name = self.checkAvaiableCamera(force=True)
+        logger.info("Camara index: {} ({})".format(self.camera_list, self.camera_name))
+        if len(self.camera_list) > 0 and not self.current_status['camera_running']:
+            self.current_status['alert']['camera_not_working'] = False
+        return self.getCamerList()
+
+    def checkAvaiableCamera(self, force=False):
+        if self.system_info == 'Linux' and os.path.isdir("/dev"):
+            logger.info("Detected Linux system | Now using V4L2 device list to check camera")
+            return listV4L2Cameras(force)
         if self.system_info == 'Windows':
             logger.info("Detected Windows system | Now using pygrabber to check camera")
             devices = FilterGraph().get_input_devices()
@@ -338,106 +883,294 @@ class TFMane:
                 return available_cameras_id, available_cameras_name
 
 
+    def benchmarkModel(self, model_name=None, runs=50, warmup=5, threads=None):
+        # Load the model with each thread setting, run warm invokes and report the latency
+        # It use its own interpreter, so the running detection is not touched
+        # Raise FileNotFoundError if the model file is missing, ValueError if it can not be loaded,
+        # return None if another benchmark is already running
+        model_name = model_name or self.sysmane.getCurrentModel()
+        model_config = self.sysmane.getModelConfig(model_name)
+        if not model_config.get("model_file"):
+            raise FileNotFoundError("Model {} has no model_file in config.json".format(model_name))
+        model_path = self.sysmane.getFullModelPath(model_name)
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError("Model file not found: {}".format(model_path))
+        options = dict(model_config.get("interpreter") or {})
+        # Clamp the work so a request can not starve the live detection for minutes
+        runs = max(1, min(int(runs), BENCHMARK_MAX_RUNS))
+        warmup = max(0, min(int(warmup), BENCHMARK_MAX_WARMUP))
+        threads = sorted(set(max(1, min(int(thread), BENCHMARK_MAX_THREADS)) for thread in (threads or [1, 2, 3, 4])))
+        report = {
+            "model": model_name,
+            "runs": runs,
+            "results": [],
+            "best_num_threads": None,
+        }
+        if not self.benchmark_lock.acquire(blocking=False):
+            logger.warning("[TFMaid] Another benchmark is running")
+            return None
+        try:
+            for num_threads in threads:
+                options["num_threads"] = num_threads
+                try:
+                    interpreter = createInterpreter(model_path, options)
+                except (ValueError, RuntimeError) as e:
+                    raise ValueError("Can not load model {}: {}".format(model_name, e))
+                input_details = interpreter.get_input_details()[0]
+                if input_details['dtype'] == np.float32:
+                    input_data = np.random.uniform(-1, 1, input_details['shape']).astype(np.float32)
+                else:
+                    input_data = np.random.randint(0, 255, input_details['shape']).astype(input_details['dtype'])
+                interpreter.set_tensor(input_details['index'], input_data)
+                for i in range(warmup):
+                    interpreter.invoke()
+                latency = []
+                for i in range(runs):
+                    t1 = time.perf_counter()
+                    interpreter.invoke()
+                    latency.append((time.perf_counter() - t1) * 1000)
+                result = {
+                    "num_threads": num_threads,
+                    "p50_ms": float(np.percentile(latency, 50)),
+                    "p95_ms": float(np.percentile(latency, 95)),
+                    "mean_ms": float(np.mean(latency)),
+                }
+                logger.info("[TFMaid] Benchmark {} | threads: {} | p50: {:.2f} ms | p95: {:.2f} ms".format(model_name, num_threads, result["p50_ms"], result["p95_ms"]))
+                report["results"].append(result)
+                del interpreter
+        finally:
+            self.benchmark_lock.release()
+        if report["results"]:
+            report["best_num_threads"] = min(report["results"], key=lambda result: result["p50_ms"])["num_threads"]
+        return report
+
+    def setDetectMode(self, mode, target_fps=None):
+        # max       = run inference on every new frame as fast as possible
+        # target_fps = run at most target_fps inferences per second
+        # on_demand = do not run in background, only when runDetect() is called
+        if mode not in self.detect_modes:
+            logger.error("[TFMaid] Invalid detect mode: {}".format(mode))
+            return False
+        if target_fps is not None:
+            if target_fps <= 0:
+                logger.error("[TFMaid] Invalid target fps: {}".format(target_fps))
+                return False
+            self.target_fps = float(target_fps)
+        self.detect_mode = mode
+        self.current_status['detect_mode'] = mode
+        self.current_status['target_fps'] = self.target_fps
+        # Wake up the detect loop if it is waiting in on_demand mode
+        self.detect_event.set()
+        logger.info("[TFMaid] Detect mode: {} (target fps: {})".format(mode, self.target_fps))
+        return True
+
+    def detectFrame(self, frame):
+        # Run the model on one frame and return the result, do not touch current_status
+        t1 = time.perf_counter()
+
+        # The interpreter (and the preprocess buffers) are shared by the background loop and runDetect,
+        # only one frame at a time
+        with self.interpreter_lock:
+            if self.zero_copy:
+                # Acquire frame and resize to expected shape [1xHxWx3] straight into the input tensor
+                input_data = self.input_tensor()
+                self.preprocess(frame, input_data)
+                # The interpreter refuse to invoke while we still hold a view of its buffer
+                del input_data
+            else:
+                self.preprocess(frame, self.input_data)
+                self.interpreter.set_tensor(self.input_index,self.input_data)
+
+            # Perform the actual detection by running the model with the image as input
+            self.interpreter.invoke()
+
+            # Retrieve detection results (only the detections above the threshold are copied)
+            boxes, classes, scores = self.readDetections()
+
+            # Labels and image size must match the model that produced the detections (see swapModel)
+            result = self.buildResult(boxes, classes, scores)
+        result['inference_time'] = time.perf_counter() - t1
+        return result
+
+    def buildResult(self, boxes, classes, scores):
+        # Turn the detections (already filtered and sorted by readDetections) into the published result
+        result = {
+            "box": None,
+            "detections": [],
+            "current_classes": None,
+            "confident_score": 0,
+            "detect_flag": False,
+            "inference_time": 0,
+        }
+
+        if scores.size > 0:
+            # Scale all boxes at once, interpreter can return coordinates that are outside of image dimensions
+            # so clip them to be within the image ([ymin, xmin, ymax, xmax])
+            coords = boxes * np.array([self.imageHeight, self.imageWidth, self.imageHeight, self.imageWidth])
+            np.clip(coords, 1, [self.imageHeight, self.imageWidth, self.imageHeight, self.imageWidth], out=coords)
+            coords = coords.astype(int)
+            # Look up object name from "labels" array using class index
+            object_names = self.label_array[classes.astype(int)]
+            persent_scores = (scores * 100).astype(int) # 0.72 to 72%
+
+            result['detect_flag'] = True
+            result['current_classes'] = object_names[0]
+            result['confident_score'] = int(persent_scores[0])
+            result['box'] = {}
+            for i, ((ymin, xmin, ymax, xmax), object_name, persent_score) in enumerate(zip(coords.tolist(), object_names, persent_scores.tolist())):
+                label = '%s: %d%%' % (object_name, persent_score) # Example: 'person: 72%'
+                labelSize, baseLine = self.getLabelSize(label)
+                label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
+                result['box']["box-{}".format(i)] = {
+                    "xmin": xmin,
+                    "ymin": ymin,
+                    "xmax": xmax,
+                    "ymax": ymax,
+                    "label": label,
+                    "labelSize": labelSize,
+                    "baseLine": baseLine,
+                    "label_ymin": label_ymin,
+                    "object_name": object_name,
+                    "persent_scores": persent_score
+                }
+                # Compact form: [object_name, persent_scores, xmin, ymin, xmax, ymax]
+                result['detections'].append([object_name, persent_score, xmin, ymin, xmax, ymax])
+
+        return result
+
+    def readDetections(self):
+        # Return (boxes, classes, scores) of the detections above the minimum threshold, best score first
+        # Must be called with interpreter_lock held, the returned arrays are copies so the views can be released
+        if self.zero_copy:
+            boxes = self.output_tensors[self.boxes_idx]()[0] # Bounding box coordinates of detected objects
+            classes = self.output_tensors[self.classes_idx]()[0] # Class index of detected objects
+            scores = self.output_tensors[self.scores_idx]()[0] # Confidence of detected objects
+        else:
+            boxes = self.interpreter.get_tensor(self.output_details[self.boxes_idx]['index'])[0]
+            classes = self.interpreter.get_tensor(self.output_details[self.classes_idx]['index'])[0]
+            scores = self.interpreter.get_tensor(self.output_details[self.scores_idx]['index'])[0]
+        keep = np.flatnonzero((scores > self.min_conf_threshold) & (scores <= 1.0))
+        keep = keep[np.argsort(-scores[keep], kind="stable")]
+        # Fancy indexing copy only the kept rows
+        return boxes[keep], classes[keep], scores[keep]
+
+    def getLabelSize(self, label):
+        # Label text is one of (class x 0-100%), measure each one only once
+        if label not in self.label_size_cache:
+            self.label_size_cache[label] = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2) # Get font size
+        return self.label_size_cache[label]
+
+    def publishResult(self, result):
+        # Keep the last detected class when nothing is detected in this frame (ArmMane read it later)
+        self.current_status['box'] = result['box']
+        self.current_status['detections'] = result['detections']
+        self.current_status['detect_flag'] = result['detect_flag']
+        if result['current_classes'] is not None:
+            self.current_status['current_classes'] = result['current_classes']
+            self.current_status['confident_score'] = result['confident_score']
+        self.current_status['inference_time'] = result['inference_time']
+        self.current_status['alert']['model_not_working'] = False
+        self.sysmane.setCurrentResult(self.current_status)
+
+    def runDetect(self, n_frames=1, timeout=5):
+        # On demand detection, run n_frames inferences on fresh frames and return the results
+        results = []
+        deadline = time.time() + timeout
+        last_frame_id = None
+        while len(results) < n_frames and time.time() < deadline:
+            if self.video is None:
+                logger.info("[TFMaid] Detect that video is not ready, can't run detection")
+                break
+            frame_id, frame = self.video.waitForFrame(last_frame_id, timeout=max(0, deadline - time.time()))
+            if frame is None:
+                continue
+            last_frame_id = frame_id
+            result = self.detectFrame(frame)
+            self.publishResult(result)
+            results.append(result)
+        return results
+
+    def classify(self, n_frames=5, min_conf=None, timeout=3, method="vote"):
+        # Run n_frames inferences on fresh frames and aggregate them into one decision
+        # vote = the class found in most frames wins (tie broken by mean score)
+        # mean = the class with the highest mean score over all frames wins
+        t1 = time.perf_counter()
+        if min_conf is None:
+            min_conf = self.model_config.get("config","min_conf_threshold")
+        votes = {}
+        scores = {}
+        results = self.runDetect(n_frames, timeout)
+        for result in results:
+            object_name = result['current_classes']
+            if object_name is None or result['confident_score'] < min_conf * 100:
+                continue
+            votes[object_name] = votes.get(object_name, 0) + 1
+            scores[object_name] = scores.get(object_name, 0) + result['confident_score']
+
+        decision = {
+            "current_classes": None,
+            "confident_score": 0,
+            "votes": votes,
+            "frames": len(results),
+            "elapsed": 0,
+        }
+        if votes:
+            if method == "mean":
+                object_name = max(scores, key=lambda name: scores[name] / len(results))
+            else:
+                object_name = max(votes, key=lambda name: (votes[name], scores[name] / votes[name]))
+            decision['current_classes'] = object_name
+            decision['confident_score'] = int(scores[object_name] / votes[object_name])
+        decision['elapsed'] = time.perf_counter() - t1
+        logger.info("[TFMaid] Classify: {} ({}%) from {} frames in {:.3f}s, votes: {}".format(decision['current_classes'], decision['confident_score'], decision['frames'], decision['elapsed'], votes))
+        return decision
+
     def  detect(self):
-        # if self.video is None:
-        #     logger.info("[TFMaid] Detect that video is not ready,  So now It's been closed")
-        #     return False
-        
         self.close = False
         logger.info("[TFMaid] Detecting")
-        # Initialize frame rate calculation
-        frame_rate_calc = 1
-        freq = cv2.getTickFrequency()
-        # Initialize video stream
+        # Skip the frame that already processed
+        last_frame_id = None
 
-        #for frame1 in camera.capture_continuous(rawCapture, format="bgr",use_video_port=True):
         while True:
 
-            if self.current_status['detect_running'] == False:
-                time.sleep(1)
+            if self.current_status['detect_running'] == False or self.detect_mode == "on_demand":
+                # Sleep until startDetect or setDetectMode wake it up, then check again
+                self.detect_event.wait()
+                self.detect_event.clear()
+                self.last_publish = None
                 continue
-            
-            # Start timer (for calculating frame rate)
-            t1 = cv2.getTickCount()
+
+            # Start timer (for pacing the target fps)
+            t1 = time.perf_counter()
 
             try:
                 # Grab frame from video stream
-                frame1 = self.video.read()
-
-                # Acquire frame and resize to expected shape [1xHxWx3]
-                frame = frame1.copy()
-                # Encode the frame as JPEG
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frame_resized = cv2.resize(frame_rgb, (self.width, self.height))
-                input_data = np.expand_dims(frame_resized, axis=0)
-
-                # Normalize pixel values if using a floating model (i.e. if model is non-quantized)
-                if self.floating_model:
-                    input_data = (np.float32(input_data) - self.model_config.get("config","input_mean")) /  self.model_config.get("config","input_std")
-
-                # Perform the actual detection by running the model with the image as input
-                self.interpreter.set_tensor(self.input_details[0]['index'],input_data)
-                self.interpreter.invoke()
-                
-                # Retrieve detection results
-                boxes = self.interpreter.get_tensor(self.output_details[self.boxes_idx]['index'])[0] # Bounding box coordinates of detected objects
-                classes = self.interpreter.get_tensor(self.output_details[self.classes_idx]['index'])[0] # Class index of detected objects
-                scores = self.interpreter.get_tensor(self.output_details[self.scores_idx]['index'])[0] # Confidence of detected objects
-                
-                # Remove the old box
-                if 'box' in self.current_status and self.current_status['box'] is not None:
-                    self.current_status['box'] = None
-
-                # Loop over all detections and draw detection box if confidence is above minimum threshold
-                for i in range(len(scores)):
-                    if ((scores[i] > self.model_config.get("config","min_conf_threshold")) and (scores[i] <= 1.0)):
-                        # Get bounding box coordinates and draw box
-                        # Interpreter can return coordinates that are outside of image dimensions, need to force them to be within image using max() and min()
-                        self.current_status['detect_flag'] = True
-                        ymin = int(max(1,(boxes[i][0] * self.imageHeight)))
-                        xmin = int(max(1,(boxes[i][1] * self.imageWidth)))
-                        ymax = int(min(self.imageHeight,(boxes[i][2] * self.imageHeight)))
-                        xmax = int(min(self.imageWidth,(boxes[i][3] * self.imageWidth)))
-
-
-                        # # #DEPRECATED : After build 202309290001 - we will use the new way to send the result
-                        # # Draw the new box
-                        # cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), (10, 255, 0), 2)
-
-                        # Draw label
-                        object_name = self.labels[int(classes[i])] # Look up object name from "labels" array using class index
-                        self.current_status['current_classes'] = object_name
-                        persent_scores  = int(scores[i]*100)# 0.72 to 72%'
-                        self.current_status['confident_score'] = persent_scores
-                        label = '%s: %d%%' % (object_name, persent_scores) # Example: 'person: 72%'
-                        labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2) # Get font size
-                        label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
-                        
-                        self.current_status['box'] = {
-                            # box-xxx
-                            "box-{}".format(i): {
-                                    "xmin": xmin,
-                                    "ymin": ymin,
-                                    "xmax": xmax,
-                                    "ymax": ymax,
-                                    "label": label,
-                                    "labelSize": labelSize,
-                                    "baseLine": baseLine,
-                                    "label_ymin": label_ymin,
-                                    "object_name": object_name,
-                                    "persent_scores": persent_scores
-                                }
-                        }
-                        # #DEPRECATED : After build 202309290001 - we will use the new way to send the result
-                        # cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), (255, 255, 255), cv2.FILLED) # Draw white box to put label text in
-                        # cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2) # Draw label text
-                
-                #Determine if the box is empty
-                if 'box' in self.current_status and self.current_status['box'] is None:
-                    self.current_status['detect_flag'] = False
+                # Wake up exactly when a new frame is captured
+                frame_id, frame = self.video.waitForFrame(last_frame_id, timeout=1)
+                if frame is None:
+                    continue
+                last_frame_id = frame_id
+
+                if self.pipeline_enabled:
+                    # Preprocess here, then hand over to the infer stage and go grab the next frame
+                    with self.swap_lock:
+                        try:
+                            input_data = self.pipeline_free.get_nowait()
+                        except queue.Empty:
+                            # Every buffer is still in flight, skip this frame rather than overwrite one
+                            continue
+                        try:
+                            self.preprocess(frame, input_data, self.pipeline_resized, self.pipeline_rgb)
+                        except Exception:
+                            self.pipeline_free.put(input_data)
+                            raise
+                        generation = self.model_generation
+                    latency = time.perf_counter() - t1
+                    self.preprocess_latency = 0.8 * self.preprocess_latency + 0.2 * latency if self.preprocess_latency else latency
+                    self.infer_stage.put({"frame_id": frame_id, "start": t1, "input": input_data, "generation": generation})
                 else:
-                    self.current_status['detect_flag'] = True
-            
+                    result = self.detectFrame(frame)
+
             except Exception as e:
                 logger.info("Error when detect: {}".format(e))
                 logger.info("Maybe camera is offline or disconnected, or you switch the camera")
@@ -448,34 +1181,16 @@ class TFMane:
                 self.current_status['fps'] = 0
                 self.current_status['current_result'] = None
                 self.sysmane.setCurrentResult(self.current_status)
+                self.last_publish = None
                 time.sleep(1)
                 continue
 
-            # Calculate framerate
-            t2 = cv2.getTickCount()
-            time1 = (t2-t1)/freq
-            frame_rate_calc= 1/time1
-            self.current_status['fps'] = frame_rate_calc
-
-
-            # #DEPRECATED : After build 202309290001 - we will use the new way to send the result
-            # # Draw framerate in corner of frame
-            # cv2.putText(frame,'FPS: {0:.2f}'.format(frame_rate_calc),(30,50),cv2.FONT_HERSHEY_SIMPLEX,1,(255,255,0),2,cv2.LINE_AA)
-            # _, png_result = cv2.imencode(".jpg", frame)
-            # base64_result = base64.b64encode(png_result).decode("utf-8")
-            # self.current_status['current_result'] = base64_result
-
-            self.sysmane.setCurrentResult(self.current_status)
-
-            time.sleep(1)
-            # All the results have been drawn on the frame, so it's time to display it.
-            # cv2.imshow('Object detector', frame)
-            # Press 'q' to quit
-            # if cv2.waitKey(1) == ord('q'):
-            #if self.closeDetect():
-                # break
-        # Clean up
-        # destroyAllWindows()
-        # self.video.stop()
-
-        
\ No newline at end of file
+            if not self.pipeline_enabled:
+                self.updateThroughput()
+                self.current_status['latency'] = time.perf_counter() - t1
+                self.publishResult(result)
+
+            if self.detect_mode == "target_fps":
+                remaining = 1 / self.target_fps - (time.perf_counter() - t1)
+                if remaining > 0:
+                    time.sleep(remaining)
@@ -2,6 +2,7 @@ import os
 from loguru import logger
 
 from app import sysmane as smn
+from app import planmane as pmn
 import threading
 import time
 import random
@@ -60,6 +61,7 @@ class ArmMane:
 
     def setSorting(self,sortNumber):
         self.status["sorting"] = sortNumber
+        self.publishStatus()
         return True
 
     def getSorting(self):
@@ -68,6 +70,10 @@ class ArmMane:
     def getCurrentStatus(self):
         return self.status
 
+    def publishStatus(self):
+        # Push the change to Server Sent Event clients (no-op when nobody is listening)
+        self.sysm.events.publish("arm_status")
+
     def setMode(self,mode):
         if(mode == "auto"):
             if(self.status["mode"] == 1):
@@ -81,10 +87,12 @@ class ArmMane:
         else:
             logger.error("Invalid mode")
             return False
+        self.publishStatus()
         return True
     
     def setItem(self,box_number,item_number):
         self.status["items"][box_number-1] = item_number
+        self.publishStatus()
         return True
     
 
@@ -124,6 +132,7 @@ class ArmMane:
             else:
                 self.status["step"] = 1
             logger.debug(f"Proceed to step {self.status['step']}")
+            self.publishStatus()
 
             # Check if the mode is still auto
             if(self.status["mode"] == 0):
@@ -144,37 +153,40 @@ class ArmMane:
         #Step 0: Reset the arm to the initial position
         # foreach the automatic_step of step0 in config
         #   send the instruction to the serial
-        for step in self.sysm.app_config.get("automatic_step","step"+str(current_step)):
-            # If the instruction example are: delay0.0 or delay1 or delay0.55
-            if(step.startswith("delay")):
-                # Split the instruction to get the delay time
-                delay_time = step.split("delay")[1]
-                logger.debug(f"Delay for {delay_time} seconds")
-                # Wait for the delay time
-                time.sleep(float(delay_time))
-                
-            else:
+        self.runSequence(self.sysm.plans.automatic_steps.get("step"+str(current_step)), "step"+str(current_step))
+
+        # Wait for the reset to finish
+        logger.debug("Waiting for the instruction to finish")
+        self.waitInstruction()
+
+        logger.debug("Instruction finished")
 
-                logger.debug(f"Prepare to send instuction {step} to serial")
+
+    def runSequence(self, plan, name):
+        # plan is compiled by PlanMane from automatic_step / grab_step / drop_step
+        if plan is None:
+            logger.error(f"Step {name} not found in config")
+            return
+        for entry in plan:
+            if isinstance(entry, pmn.Delay):
+                logger.debug(f"Delay for {entry.seconds} seconds")
+                # Wait for the delay time
+                time.sleep(entry.seconds)
+            elif isinstance(entry, pmn.PresetCall):
+                logger.debug(f"Prepare to send instuction {entry.name} to serial")
                 #If serial is busy, wait until it's idle
                 while(self.seri.current_status["busy"]):
                     time.sleep(0.1)
                 # Send the instruction to the serial
-                self.seri.piInstructionPreset(step)
-                logger.debug(f"Instuction {step} sent to serial for execution")
-
-        # Wait for the reset to finish
-        logger.debug("Waiting for the instruction to finish")
-        finish_count = 0
-        while(self.seri.current_status["busy"] or finish_count <10):
-            time.sleep(0.1)
-            if(self.seri.current_status["busy"]):
-                logger.debug("Instruction still running, Waiting for it to finish")
-                finish_count = 0
+                self.seri.piInstructionPreset(entry.name)
+                logger.debug(f"Instuction {entry.name} sent to serial for execution")
             else:
-                finish_count += 1
+                logger.debug(f"{entry.name} is run by its own step, skip it")
 
-        logger.debug("Instruction finished")
+    def waitInstruction(self):
+        # Return as soon as the Arduino acknowledged (INST) every instruction sent, no fixed settle time
+        if not self.seri.waitIdle(self.sysm.plans.limits.ack_timeout):
+            logger.warning("Arduino did not acknowledge every instruction in time, continue anyway")
 
 
     def runStep(self,step):
@@ -231,20 +243,15 @@ class ArmMane:
                 logger.warning("Trying with fixed delay instead (10 seconds)")
                 time.sleep(10)
             else:
-                # Wait for sensor to detect the item
+                # Wait for sensor to detect the item, woken up by the GPIO edge interrupt
                 logger.debug("Waiting for the sensor to detect the item")
-                while(not self.seri.current_status["sensor"]["value"]):
-                    count = count+1
-                    time.sleep(0.1)
-                    logger.debug(count)
-                    if count >= 120:
-                        self.status["error"] = 404
-                        logger.error("No object on conveyor")
-                        self.stepControl(4.1)
-                        self.status["step"] = 0
-                        self.status["items"][self.currentBox] += 1
-                        self.status["alert"]["not_find_object"] = True
-                        break
+                if not self.seri.waitForItem(timeout=12):
+                    self.status["error"] = 404
+                    logger.error("No object on conveyor")
+                    self.stepControl(4.1)
+                    self.status["step"] = 0
+                    self.status["items"][self.currentBox] += 1
+                    self.status["alert"]["not_find_object"] = True
 
             if self.status["step"] != 0:     
                 self.status["error"] = 0
@@ -253,17 +260,17 @@ class ArmMane:
                 self.status["alert"]["not_find_object"] = False
                 #Open camera
                 self.tfma.startCamera()
-                time.sleep(1)
-                #Detect the item
-                self.tfma.startDetect()
-                time.sleep(3)
-                # if self.sysm.running["current_classes"] != None:
-                #     result = self.sysm.running["current_classes"].split("_")
-                #     logger.debug(result)
                     #Chose which box to be drop
+                classify_frames = int(self.sysm.app_config.get("classify_frames") or 5)
+                classify_timeout = float(self.sysm.app_config.get("classify_timeout") or 3)
+                decision = None
                 while self.status["drop"] == None:
-                    if self.sysm.running["current_classes"] != None and self.sysm.running["current_classes"] != "":
-                        result = self.sysm.running["current_classes"].split("_")
+                    #Detect the item, return as soon as enough fresh frames are classified (no fixed sleep)
+                    #After a reverse, use the decision made by the retry loop
+                    if decision is None:
+                        decision = self.tfma.classify(n_frames=classify_frames, timeout=classify_timeout)
+                    if decision["current_classes"] != None:
+                        result = decision["current_classes"].split("_")
                         logger.debug(result)
                         if (self.status["sorting"] == 0) :
                             logger.debug("IN SHAPE")
@@ -321,11 +328,13 @@ class ArmMane:
                         if count > 5 :
                             self.status["alert"]["not_recognize_object_limit"] = True
 
-                        if self.sysm.running["current_classes"] != None:
+                        #Classify again after the reverse, the next round of the outer loop choose the box with it
+                        decision = self.tfma.classify(n_frames=classify_frames, timeout=classify_timeout)
+                        if decision["current_classes"] != None:
                             self.status["alert"]["not_recognize_object"] = False
                             self.status["alert"]["not_recognize_object_limit"] = False
 
-                        if count >5 or self.sysm.running["current_classes"] != None:
+                        if count >5 or decision["current_classes"] != None:
                             break
 
     
@@ -343,7 +352,6 @@ class ArmMane:
                 self.status["alert"]["not_recognize_object"] = False
                 # Stop the camera
                 self.tfma.stopDetect()
-                time.sleep(1)
                 self.tfma.stopCamera()
                 logger.debug("Proceed to next step")
                 self.stepControl(4.4) #Move the conveyor > Close gate > Stop the conveyor > Open gate
@@ -385,32 +393,10 @@ class ArmMane:
             return 0
         else:
             logger.debug(f"Box number {box_number+1} now has {self.status['items'][box_number]} items, Proceed to grab the item")
-            for step in self.sysm.app_config.get("grab_step","grab"+str(box_number)):
-                # If the instruction example are: delay0.0 or delay1 or delay0.55
-                if(step.startswith("delay")):
-                    # Split the instruction to get the delay time
-                    delay_time = step.split("delay")[1]
-                    logger.debug(f"Delay for {delay_time} seconds")
-                    # Wait for the delay time
-                    time.sleep(float(delay_time))
-                else:
-                    logger.debug(f"Prepare to send instuction {step} to serial")
-                    #If serial is busy, wait until it's idle
-                    while(self.seri.current_status["busy"]):
-                        time.sleep(0.1)
-                    # Send the instruction to the serial
-                    self.seri.piInstructionPreset(step)
-                    logger.debug(f"Instuction {step} sent to serial for execution")
+            self.runSequence(self.sysm.plans.grab_steps.get("grab"+str(box_number)), "grab"+str(box_number))
             # Wait for the grab to finish
             logger.debug(f"Waiting for the grab from box number {box_number+1} to finish")
-            finish_count = 0
-            while(self.seri.current_status["busy"] or finish_count <10):
-                time.sleep(0.1)
-                if(self.seri.current_status["busy"]):
-                    logger.debug("Instruction still running, Waiting for it to finish")
-                    finish_count = 0
-                else:
-                    finish_count += 1
+            self.waitInstruction()
 
             #Check is grab sensor is working
             if(self.status["alert"]["gripcheck_not_working"]):
@@ -441,36 +427,12 @@ class ArmMane:
 
 
     def dropBox(self,box_number):
-        for step in self.sysm.app_config.get("drop_step","drop"+str(box_number)):
-            # If the instruction example are: delay0.0 or delay1 or delay0.55
-            if(step.startswith("delay")):
-                # Split the instruction to get the delay time
-                delay_time = step.split("delay")[1]
-                logger.debug(f"Delay for {delay_time} seconds")
-                # Wait for the delay time
-                time.sleep(float(delay_time))
-            else:
-                logger.debug(f"Prepare to send instuction {step} to serial")
-                #If serial is busy, wait until it's idle
-                while(self.seri.current_status["busy"]):
-                    time.sleep(0.1)
-                # Lookup the instruction preset
-                # piInstructionPreset
-                self.seri.piInstructionPreset(step)
-                
-                logger.debug(f"Instuction {step} sent to serial for execution")
-            
+        self.runSequence(self.sysm.plans.drop_steps.get("drop"+str(box_number)), "drop"+str(box_number))
+
         # Wait for the drop to finish
         logger.debug(f"Waiting for the drop to box number {box_number} to finish")
-        finish_count = 0
-        while(self.seri.current_status["busy"] or finish_count <10):
-            time.sleep(0.1)
-            if(self.seri.current_status["busy"]):
-                logger.debug("Instruction still running, Waiting for it to finish")
-                finish_count = 0
-            else:
-                finish_count += 1
-                
+        self.waitInstruction()
+
         logger.debug(f"Drop to box number {box_number} finished")
         self.status["items"][box_number] += 1
         logger.debug(f"Box number {box_number+1} now has {self.status['items'][box_number]} items")
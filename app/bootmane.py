@@ -0,0 +1,64 @@
+import threading
+import time
+from loguru import logger
+
+
+class BootMane:
+    """Bring the subsystems up in background threads and keep track of their readiness"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.components = {}
+        self.ready_events = {}
+        self.boot_time = time.time()
+
+    def start(self, name, factory, requires=None):
+        # factory() build the subsystem, it only run after every component in requires is ready
+        requires = requires or []
+        with self.lock:
+            self.components[name] = {
+                "state": "waiting" if requires else "starting",
+                "requires": requires,
+                "started_at": None,
+                "startup_time": None,
+                "error": None,
+            }
+            self.ready_events[name] = threading.Event()
+        boot_thread = threading.Thread(target=self.run, args=(name, factory, requires))
+        boot_thread.daemon = True
+        boot_thread.start()
+
+    def run(self, name, factory, requires):
+        component = self.components[name]
+        for required in requires:
+            self.ready_events[required].wait()
+            if self.components[required]["state"] != "ready":
+                component["state"] = "failed"
+                component["error"] = "{} failed to start".format(required)
+                logger.error("[BootMane] {} not started because {} failed".format(name, required))
+                self.ready_events[name].set()
+                return
+        component["state"] = "starting"
+        component["started_at"] = time.time() - self.boot_time
+        logger.info("[BootMane] Starting {}".format(name))
+        t1 = time.perf_counter()
+        try:
+            factory()
+        except Exception as e:
+            component["state"] = "failed"
+            component["error"] = str(e)
+            logger.exception("[BootMane] {} failed to start: {}".format(name, e))
+        else:
+            component["state"] = "ready"
+            logger.success("[BootMane] {} ready in {:.2f}s".format(name, time.perf_counter() - t1))
+        component["startup_time"] = time.perf_counter() - t1
+        self.ready_events[name].set()
+
+    def isReady(self, name):
+        return name in self.components and self.components[name]["state"] == "ready"
+
+    def getStatus(self):
+        with self.lock:
+            return {
+                "ready": all(component["state"] == "ready" for component in self.components.values()),
+                "components": {name: dict(component) for name, component in self.components.items()},
+            }
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import threading
+import time
+from loguru import logger
+
+
+def escapePath(key):
+    # JSON pointer escaping (RFC 6901)
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def diffStatus(old, new, path=""):
+    """Return JSON-patch style operations (RFC 6902 subset) that turn old into new"""
+    if type(old) != type(new):
+        return [{"op": "replace", "path": path, "value": new}]
+    if isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": path + "/" + escapePath(key)})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": path + "/" + escapePath(key), "value": value})
+            else:
+                ops.extend(diffStatus(old[key], value, path + "/" + escapePath(key)))
+        return ops
+    if isinstance(new, list):
+        # Lists in the status are short and fixed size (servo, conv), resend the whole list when the size change
+        if len(old) != len(new):
+            return [{"op": "replace", "path": path, "value": new}]
+        ops = []
+        for i, value in enumerate(new):
+            ops.extend(diffStatus(old[i], value, path + "/" + str(i)))
+        return ops
+    if old != new:
+        return [{"op": "replace", "path": path, "value": new}]
+    return []
+
+
+class EventSubscriber:
+    """One SSE client, only remember which version of each event it already sent"""
+    def __init__(self, loop, mode="full"):
+        self.loop = loop
+        # full  = send the whole dict on every change
+        # patch = send "<event>_patch" with the operations since the last sent version, full dict as keyframe
+        self.mode = mode
+        self.event = asyncio.Event()
+        self.sent = {}
+
+    def wake(self):
+        # Called from any thread, hand the wake up to the client's event loop
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            pass
+
+
+class EventMane:
+    """Central status hub, serialize each change once and share the payload with every SSE client"""
+    def __init__(self, poll_interval=0.5, keyframe_interval=5, patch_history=64):
+        self.poll_interval = poll_interval
+        self.keyframe_interval = keyframe_interval
+        self.patch_history = patch_history
+        self.lock = threading.Lock()
+        self.sources = {}
+        self.payloads = {}
+        # For patch mode: last snapshot, chain of (version, base_version, operations) and last keyframe time
+        self.snapshots = {}
+        self.patches = {}
+        self.keyframes = {}
+        self.version = 0
+        self.subscribers = []
+        self.thread = None
+
+    def register(self, event, getter):
+        # getter return the current dict of the event (e.g. seri.getCurrentStatus)
+        self.sources[event] = getter
+
+    def publish(self, event, data=None):
+        # Nobody is listening, skip the serialization entirely
+        if not self.subscribers:
+            return False
+        if data is None:
+            getter = self.sources.get(event)
+            if getter is None:
+                return False
+            data = getter()
+        try:
+            payload = json.dumps(data)
+        except (TypeError, ValueError, RuntimeError) as e:
+            # RuntimeError happen when another thread change the dict while dumping, next publish will catch up
+            logger.debug(f"[EventMane] Can not serialize {event}: {e}")
+            return False
+
+        with self.lock:
+            last = self.payloads.get(event)
+            if last is not None and last[1] == payload:
+                return False
+            self.version += 1
+            self.payloads[event] = (self.version, payload)
+            self.updatePatch(event, last, payload)
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            subscriber.wake()
+        return True
+
+    def updatePatch(self, event, last, payload):
+        # Diff once against the last snapshot, the result is shared by every patch client
+        if not any(subscriber.mode == "patch" for subscriber in self.subscribers):
+            self.snapshots.pop(event, None)
+            self.patches.pop(event, None)
+            return
+        snapshot = json.loads(payload)
+        old_snapshot = self.snapshots.get(event)
+        self.snapshots[event] = snapshot
+        now = time.time()
+        if old_snapshot is None or last is None or now - self.keyframes.get(event, 0) >= self.keyframe_interval:
+            # Keyframe, drop the chain so every patch client resync with the full dict
+            self.keyframes[event] = now
+            self.patches[event] = []
+            return
+        operations = json.dumps(diffStatus(old_snapshot, snapshot))[1:-1]
+        chain = self.patches.setdefault(event, [])
+        if len(operations) >= len(payload) or len(chain) >= self.patch_history:
+            # The patch is not worth it, send the full dict instead
+            self.keyframes[event] = now
+            self.patches[event] = []
+            return
+        chain.append((self.version, last[0], operations))
+
+    def publishAll(self):
+        for event in list(self.sources):
+            self.publish(event)
+
+    def subscribe(self, loop, mode="full"):
+        subscriber = EventSubscriber(loop, mode)
+        with self.lock:
+            self.subscribers.append(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.watch)
+                self.thread.daemon = True
+                self.thread.start()
+        # Make sure the new client get a fresh snapshot of every event
+        self.publishAll()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def pending(self, subscriber):
+        # Return the events that changed since the last time this client sent them, oldest first
+        with self.lock:
+            changed = [
+                (version, event, payload)
+                for event, (version, payload) in self.payloads.items()
+                if subscriber.sent.get(event) != version
+            ]
+            changed.sort()
+            result = []
+            for version, event, payload in changed:
+                if subscriber.mode == "patch":
+                    operations = self.patchSince(event, subscriber.sent.get(event))
+                    if operations is not None:
+                        result.append((event + "_patch", "[" + ",".join(operations) + "]"))
+                        subscriber.sent[event] = version
+                        continue
+                result.append((event, payload))
+                subscriber.sent[event] = version
+        return result
+
+    def patchSince(self, event, base_version):
+        # Find the chain of patches starting from the version this client already has
+        if base_version is None:
+            return None
+        chain = self.patches.get(event, [])
+        for i, (version, base, operations) in enumerate(chain):
+            if base == base_version:
+                return [entry[2] for entry in chain[i:] if entry[2]]
+        return None
+
+    def watch(self):
+        # Safety net for status that is changed without calling publish, run once for all clients
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            self.publishAll()
+            time.sleep(self.poll_interval)
+
+    async def stream(self, request, mode="full"):
+        subscriber = self.subscribe(asyncio.get_running_loop(), mode)
+        try:
+            yield {
+                # Send connected message to client
+                "data": json.dumps({"status": "connected"})
+            }
+            while True:
+                subscriber.event.clear()
+                for event, payload in self.pending(subscriber):
+                    yield {
+                        "event": event,
+                        "data": payload
+                    }
+                # If client closes connection, stop sending events
+                if await request.is_disconnected():
+                    break
+                try:
+                    await asyncio.wait_for(subscriber.event.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,78 @@
+import struct
+
+# Binary serial frame (host -> Arduino only, the Arduino still answer with ASCII lines), little-endian:
+#   0xA5 0x5A | type (1) | seq (1) | length (1) | payload (length) | crc8 (1)
+# crc8 (poly 0x07) is computed over type, seq, length and payload
+#
+# FRAME_STATE payload: mask (2) + values of the channels set in mask, in bit order
+#   bit 0-6 : servo 0-6     -> degree (1)
+#   bit 7-8 : conveyor 0-1  -> mode (1) + speed (1)
+#
+# FRAME_TRAJECTORY payload: mask (1) + per servo set in mask, in bit order
+#   target degree (1) + velocity deg/s (2) + acceleration deg/s^2 (2)
+# The Arduino run the trapezoid profile itself and answer "DONE{seq}" when every servo arrived
+
+FRAME_SYNC = b"\xA5\x5A"
+FRAME_STATE = 0x01
+FRAME_TRAJECTORY = 0x02
+
+SERVO_CHANNELS = 7
+CONVEYOR_CHANNELS = 2
+
+
+def buildCrcTable():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for i in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = buildCrcTable()
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = CRC_TABLE[crc ^ byte]
+    return crc
+
+
+def encodeFrame(frame_type, seq, payload):
+    body = bytes((frame_type, seq & 0xFF, len(payload))) + payload
+    return FRAME_SYNC + body + bytes((crc8(body),))
+
+
+def encodeStateFrame(seq, servos=None, conveyors=None):
+    # servos = {servo: degree}, conveyors = {conveyor: (mode, speed)}, only these channels are sent
+    servos = servos or {}
+    conveyors = conveyors or {}
+    mask = 0
+    values = bytearray()
+    for servo in range(SERVO_CHANNELS):
+        if servo in servos:
+            mask |= 1 << servo
+            values.append(int(servos[servo]))
+    for conveyor in range(CONVEYOR_CHANNELS):
+        if conveyor in conveyors:
+            mode, speed = conveyors[conveyor]
+            mask |= 1 << (SERVO_CHANNELS + conveyor)
+            values.append(int(mode))
+            values.append(int(speed))
+    return encodeFrame(FRAME_STATE, seq, struct.pack("<H", mask) + bytes(values))
+
+
+def encodeTrajectoryFrame(seq, targets, velocity, acceleration):
+    # targets = {servo: degree}, velocity and acceleration are a number or {servo: value}
+    mask = 0
+    values = b""
+    for servo in range(SERVO_CHANNELS):
+        if servo in targets:
+            servo_velocity = velocity[servo] if isinstance(velocity, dict) else velocity
+            servo_acceleration = acceleration[servo] if isinstance(acceleration, dict) else acceleration
+            mask |= 1 << servo
+            values += struct.pack("<BHH", int(targets[servo]),
+                min(int(round(servo_velocity)), 0xFFFF), min(int(round(servo_acceleration)), 0xFFFF))
+    return encodeFrame(FRAME_TRAJECTORY, seq, bytes((mask,)) + values)
@@ -0,0 +1,110 @@
+import threading
+import queue
+import time
+from collections import OrderedDict
+from loguru import logger
+
+
+class JobMane:
+    """Hardware executor, run the motion commands one at a time in a worker thread and keep their status"""
+    def __init__(self, events, history=100, reason=None):
+        # reason() return the last error message of the executed commands (e.g. SeriMane status message)
+        self.events = events
+        self.reason = reason or (lambda: None)
+        self.history = history
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()
+        self.last_id = 0
+        self.active = None
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, name, func, *args, with_progress=False, **kwargs):
+        # Queue func(*args, **kwargs) and return the job id right away
+        # The job fail if func raise or return None / False
+        # with_progress=True also pass progress=callback(done, total) to func
+        with self.lock:
+            self.last_id += 1
+            job = {
+                "id": self.last_id,
+                "name": name,
+                "state": "queued",
+                "progress": {"done": 0, "total": None},
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "queue_time": None,
+                "run_time": None,
+                "error": None,
+            }
+            self.jobs[job["id"]] = job
+            # Forget the oldest finished jobs
+            while len(self.jobs) > self.history:
+                oldest = next(iter(self.jobs.values()))
+                if oldest["state"] in ("queued", "running"):
+                    break
+                self.jobs.popitem(last=False)
+        self.queue.put((job, func, args, kwargs, with_progress))
+        self.publish()
+        return job["id"]
+
+    def run(self):
+        while True:
+            job, func, args, kwargs, with_progress = self.queue.get()
+            started = time.time()
+            with self.lock:
+                job["state"] = "running"
+                job["started_at"] = started
+                job["queue_time"] = started - job["submitted_at"]
+                self.active = job["id"]
+            self.publish()
+
+            if with_progress:
+                kwargs = dict(kwargs, progress=lambda done, total: self.setProgress(job, done, total))
+            t1 = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                logger.exception(f"[JobMane] Job {job['id']} ({job['name']}) failed: {e}")
+                state, error = "failed", str(e)
+            else:
+                # SeriMane log and return None (or False) when it reject a command
+                if result is None or result is False:
+                    state, error = "failed", self.reason() or "Command rejected"
+                else:
+                    state, error = "done", None
+            with self.lock:
+                job["state"] = state
+                job["error"] = error
+                job["run_time"] = time.perf_counter() - t1
+                job["finished_at"] = time.time()
+                if job["progress"]["total"] is None:
+                    job["progress"] = {"done": 1, "total": 1}
+                self.active = None
+            logger.debug(f"[JobMane] Job {job['id']} ({job['name']}) {state} in {job['run_time']:.2f}s")
+            self.publish()
+
+    def setProgress(self, job, done, total):
+        with self.lock:
+            job["progress"] = {"done": done, "total": total}
+        self.publish()
+
+    def getJob(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def getStatus(self, limit=20):
+        # Latest jobs first, sent to Server Sent Event clients as "jobs"
+        with self.lock:
+            return {
+                "active": self.active,
+                "queued": self.queue.qsize(),
+                "jobs": [dict(job) for job in reversed(list(self.jobs.values())[-limit:])],
+            }
+
+    def publish(self):
+        self.events.publish("jobs")
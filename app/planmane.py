@@ -0,0 +1,232 @@
+from collections import namedtuple
+from functools import lru_cache
+from loguru import logger
+
+# Compiled form of the motion config, built once at load / reload so the hot path never parse strings
+#   instructions, servo_test, conv_test -> tuple of ServoGroup / ConveyorSet
+#   automatic_step, grab_step, drop_step -> tuple of Delay / PresetCall / SectionRef
+ServoGroup = namedtuple("ServoGroup", ["targets", "settle"])  # ((servo, degree), ...) moved together
+ConveyorSet = namedtuple("ConveyorSet", ["conveyor", "mode", "speed", "settle"])
+Delay = namedtuple("Delay", ["seconds"])
+PresetCall = namedtuple("PresetCall", ["name"])
+SectionRef = namedtuple("SectionRef", ["name"])  # e.g. "grab_step" in automatic_step, run by ArmMane itself
+Limits = namedtuple("Limits", [
+    "servo_count", "min_degree", "max_degree", "conveyor_count",
+    "step", "delay", "velocity", "acceleration", "coordinated", "ack_timeout",
+    "pacing", "settle", "gripper",
+])
+
+PACING_MODES = ("ack", "model", "fixed")
+
+
+@lru_cache(maxsize=512)
+def interpolatePath(start, targets, step):
+    # start and targets are ((servo, degree), ...) in the same servo order
+    # Return the intermediate ticks, each one is ((servo, degree), ...) with only the servos that moved
+    # The arm go through the same poses every cycle, so most moves are computed only once
+    distance = max((abs(degree - begin) for (servo, begin), (_, degree) in zip(start, targets)), default=0)
+    ticks = -(-distance // step)
+    path = []
+    last = dict(start)
+    for tick in range(1, ticks):
+        changed = []
+        for (servo, begin), (_, degree) in zip(start, targets):
+            position = int(round(begin + (degree - begin) * tick / ticks))
+            if position != last[servo]:
+                changed.append((servo, position))
+                last[servo] = position
+        path.append(tuple(changed))
+    return tuple(path)
+
+
+class PlanMane:
+    def __init__(self, app_config):
+        self.app_config = app_config
+        self.limits = None
+        self.presets = {}
+        self.servo_tests = {}
+        self.conv_tests = {}
+        self.automatic_steps = {}
+        self.grab_steps = {}
+        self.drop_steps = {}
+        self.compile()
+
+    def compile(self):
+        # Build every plan from the config, raise ValueError and keep the previous plans if one step is wrong
+        limits = self.compileLimits()
+        coordinated = limits.coordinated
+        presets = {
+            name: self.compileSteps(preset.get("step", []), limits, coordinated, f"instructions.{name}")
+            for name, preset in self.getSection("instructions").items()
+        }
+        servo_tests = {
+            name: self.compileSteps(step, limits, False, f"servo_test.{name}")
+            for name, step in self.getSection("servo_test").items()
+        }
+        conv_tests = {
+            name: self.compileSteps(step, limits, False, f"conv_test.{name}")
+            for name, step in self.getSection("conv_test").items()
+        }
+        automatic_steps = {
+            name: self.compileSequence(step, presets, f"automatic_step.{name}")
+            for name, step in self.getSection("automatic_step").items()
+        }
+        grab_steps = {
+            name: self.compileSequence(step, presets, f"grab_step.{name}")
+            for name, step in self.getSection("grab_step").items()
+        }
+        drop_steps = {
+            name: self.compileSequence(step, presets, f"drop_step.{name}")
+            for name, step in self.getSection("drop_step").items()
+        }
+
+        self.limits = limits
+        self.presets = presets
+        self.servo_tests = servo_tests
+        self.conv_tests = conv_tests
+        self.automatic_steps = automatic_steps
+        self.grab_steps = grab_steps
+        self.drop_steps = drop_steps
+        logger.info(f"[PlanMane] Compiled {len(presets)} presets and {len(automatic_steps) + len(grab_steps) + len(drop_steps)} step sequences")
+
+    def getSection(self, key):
+        section = self.app_config.get(key)
+        if section is None:
+            return {}
+        if not isinstance(section, dict):
+            raise ValueError(f"{key} must be an object")
+        return section
+
+    def compileLimits(self):
+        try:
+            step = int(self.app_config.get("servo_step"))
+            delay = float(self.app_config.get("servo_delay"))
+            velocity = self.app_config.get("servo_velocity")
+            # Velocity default to the speed of the host interpolation (servo_step degree every servo_delay second)
+            velocity = float(velocity) if velocity is not None else step / delay
+            acceleration = self.app_config.get("servo_acceleration")
+            acceleration = float(acceleration) if acceleration is not None else velocity * 4
+            limits = Limits(
+                servo_count=int(self.app_config.get("servo_count")),
+                min_degree=int(self.app_config.get("servo_min_degree")),
+                max_degree=int(self.app_config.get("servo_max_degree")),
+                conveyor_count=int(self.app_config.get("conveyor_count")),
+                step=step,
+                delay=delay,
+                velocity=velocity,
+                acceleration=acceleration,
+                # Sequential until every preset is written for the coordinated motion
+                coordinated=self.app_config.get("preset_motion") == "coordinated",
+                ack_timeout=float(self.app_config.get("ack_timeout") or 2),
+                pacing=self.app_config.get("preset_pacing") or "ack",
+                settle=self.compileSettle(),
+                gripper=int(self.app_config.get("gripper_servo") or 5),
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid servo / conveyor settings: {e}")
+        if limits.pacing not in PACING_MODES:
+            raise ValueError(f"preset_pacing must be one of {PACING_MODES}, got {limits.pacing!r}")
+        if limits.step <= 0 or limits.delay < 0 or limits.velocity <= 0 or limits.acceleration <= 0:
+            raise ValueError("servo_step, servo_velocity and servo_acceleration must be positive, servo_delay can not be negative")
+        return limits
+
+    def compileSettle(self):
+        # actuator_settle = {"servo": default, "conveyor": default, "servo5": override, "conv1": override}
+        settle = self.app_config.get("actuator_settle") or {}
+        if not isinstance(settle, dict):
+            raise ValueError("actuator_settle must be an object")
+        settle = {key: float(value) for key, value in settle.items()}
+        if any(value < 0 for value in settle.values()):
+            raise ValueError("actuator_settle can not be negative")
+        return settle
+
+    def getSettle(self, limits, kind, number):
+        # Settle time of one actuator, e.g. getSettle(limits, "servo", 5) use "servo5" then "servo"
+        prefix = "servo" if kind == "servo" else "conv"
+        return limits.settle.get(f"{prefix}{number}", limits.settle.get(kind, 0.0))
+
+    def parseStep(self, action, limits=None):
+        # S00D180 -> ("servo", 0, 180), C0M1S255 -> ("conveyor", 0, 1, 255), raise ValueError if invalid
+        limits = limits or self.limits
+        try:
+            if action.startswith("S"):
+                servo, degree = int(action[1:3]), int(action[4:7])
+                if action[3] != "D":
+                    raise ValueError
+            elif action.startswith("C"):
+                conveyor, mode, speed = int(action[1:2]), int(action[3:4]), int(action[5:8])
+                if action[2] != "M" or action[4] != "S":
+                    raise ValueError
+            else:
+                raise ValueError
+        except (ValueError, IndexError):
+            raise ValueError(f"Unknown step {action!r}, expected SxxDyyy or CxMySzzz")
+
+        if action.startswith("S"):
+            if servo < 0 or servo > limits.servo_count:
+                raise ValueError(f"Servo {servo} not in range (0, {limits.servo_count})")
+            if degree < limits.min_degree or degree > limits.max_degree:
+                raise ValueError(f"Degree {degree} not in range ({limits.min_degree}, {limits.max_degree})")
+            return "servo", servo, degree
+        if conveyor < 0 or conveyor > limits.conveyor_count:
+            raise ValueError(f"Conveyor {conveyor} not in range (0, {limits.conveyor_count})")
+        if mode < 0 or mode > 2:
+            raise ValueError(f"Mode {mode} not in range (0, 1, 2)")
+        if speed < 0 or speed > 255:
+            raise ValueError(f"Speed {speed} not in range (0, 255)")
+        return "conveyor", conveyor, mode, speed
+
+    def compileSteps(self, step, limits, coordinated, where):
+        # Consecutive servo steps become one ServoGroup when coordinated, a servo used twice start a new group
+        # because the preset want it to pass through the first degree
+        # The gripper always move alone, the arm must reach the part before it close and stop before it open
+        if not isinstance(step, list):
+            raise ValueError(f"{where} must be a list of steps")
+        plan = []
+        group = None
+        for action in step:
+            try:
+                parsed = self.parseStep(action, limits)
+            except (ValueError, AttributeError) as e:
+                raise ValueError(f"{where}: {e}")
+            if parsed[0] == "conveyor":
+                group = None
+                plan.append(ConveyorSet(*parsed[1:], settle=self.getSettle(limits, "conveyor", parsed[1])))
+                continue
+            servo, degree = parsed[1], parsed[2]
+            if group is None or servo in group or not coordinated or servo == limits.gripper or limits.gripper in group:
+                group = {}
+                plan.append(group)
+            group[servo] = degree
+        # A group settle as long as its slowest servo
+        return tuple(
+            ServoGroup(
+                tuple(sorted(entry.items())),
+                max(self.getSettle(limits, "servo", servo) for servo in entry),
+            ) if isinstance(entry, dict) else entry
+            for entry in plan
+        )
+
+    def compileSequence(self, step, presets, where):
+        # ["preGetA", "delay1", "getA"] -> (PresetCall("preGetA"), Delay(1.0), PresetCall("getA"))
+        if not isinstance(step, list):
+            raise ValueError(f"{where} must be a list of steps")
+        plan = []
+        for action in step:
+            if not isinstance(action, str):
+                raise ValueError(f"{where}: invalid step {action!r}")
+            if action.startswith("delay"):
+                try:
+                    seconds = float(action[len("delay"):])
+                except ValueError:
+                    raise ValueError(f"{where}: invalid delay {action!r}")
+                if seconds < 0:
+                    raise ValueError(f"{where}: negative delay {action!r}")
+                plan.append(Delay(seconds))
+            elif action in presets:
+                plan.append(PresetCall(action))
+            elif action in ("grab_step", "drop_step"):
+                plan.append(SectionRef(action))
+            else:
+                raise ValueError(f"{where}: preset {action!r} not found in instructions")
+        return tuple(plan)
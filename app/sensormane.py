@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import deque
+from loguru import logger
+import platform
+if platform.system() == "Linux":
+    import RPi.GPIO as GPIO
+
+
+class SensorMane:
+    """Digital sensors read with GPIO edge interrupts, every change is timestamped in a ring buffer"""
+    def __init__(self, pins, debounce_ms=20, history=256):
+        # pins = {name: BCM pin number}
+        self.pins = dict(pins)
+        self.debounce_ms = debounce_ms
+        self.condition = threading.Condition()
+        # (timestamp, pin, level), timestamp is time.monotonic()
+        self.events = deque(maxlen=history)
+        self.levels = {}
+        self.listeners = []
+
+        GPIO.setmode(GPIO.BCM)
+        for name, pin in self.pins.items():
+            GPIO.setup(pin, GPIO.IN)
+            self.levels[pin] = GPIO.input(pin)
+            GPIO.add_event_detect(pin, GPIO.BOTH, callback=self.onEdge, bouncetime=debounce_ms)
+            logger.debug(f"[SensorMane] Watching {name} on GPIO {pin}")
+
+    def close(self):
+        for pin in self.pins.values():
+            GPIO.remove_event_detect(pin)
+
+    def addListener(self, callback):
+        # callback(pin, level, timestamp) is called from the GPIO thread, keep it short
+        self.listeners.append(callback)
+
+    def onEdge(self, pin):
+        level = GPIO.input(pin)
+        timestamp = time.monotonic()
+        with self.condition:
+            # bouncetime drop the fast edges, but the line can still settle on the level it started from
+            if self.levels.get(pin) == level:
+                return
+            self.levels[pin] = level
+            self.events.append((timestamp, pin, level))
+            self.condition.notify_all()
+        for callback in self.listeners:
+            try:
+                callback(pin, level, timestamp)
+            except Exception as e:
+                logger.error(f"[SensorMane] Error in sensor listener: {e}")
+
+    def getLevel(self, pin):
+        return self.levels.get(pin)
+
+    def waitForEdge(self, pin, timeout=None, level=None, since=None):
+        # Block until pin change (to level if given) after since (default now)
+        # Return the (timestamp, pin, level) event, or None on timeout
+        since = time.monotonic() if since is None else since
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for event in self.events:
+                    if event[0] > since and event[1] == pin and (level is None or event[2] == level):
+                        return event
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
@@ -8,6 +8,15 @@ if platform.system() == "Linux":
     
 import time
 import psutil
+from concurrent.futures import Future, wait as waitFutures
+try:
+    import framemane as fmn
+    import planmane as pmn
+    import sensormane as snm
+except:
+    from app import framemane as fmn
+    from app import planmane as pmn
+    from app import sensormane as snm
 
 
 class SeriMane:
@@ -59,11 +68,34 @@ class SeriMane:
         }
 
         self.sensor = None
+        self.sensors = None
         self.arduino_port = None
         self.arduino = None
         self.current_status["emergency"] = False
         self.extended_log = False
 
+        # ascii  = one 29 characters line with every servo and conveyor (original firmware)
+        # binary = framemane frame with only the changed channels (needs the binary firmware)
+        self.serial_protocol = self.sysmane.app_config.get("serial_protocol") or "ascii"
+        self.frame_seq = 0
+        # Trajectories sent in binary mode, seq -> Event set when the Arduino answer DONE{seq}
+        self.motion_lock = threading.Lock()
+        self.motion_waiters = {}
+        # Every line sent get a number, resolved when the Arduino answer INST{number}
+        self.ack_lock = threading.Lock()
+        self.command_seq = -1
+        self.pending_acks = {}
+        # Message type (line prefix) -> callbacks, called by the receive thread for every matching line
+        self.message_lock = threading.Lock()
+        self.message_handlers = {}
+        # Set while a real serial port is open, the receive thread sleep on it otherwise
+        self.serial_connected = threading.Event()
+        # Set by the GPIO callbacks, the publish thread push the status to the Server Sent Event clients
+        self.status_changed = threading.Event()
+        self.onMessage("Ready!", self.onArduinoReady)
+        self.onMessage("INST", self.onInstruction)
+        self.onMessage("DONE", lambda line: self.finishMotion(line[4:]))
+
 
         #FOR DEBUG WITHOUT ARDUINO ON WINDOWS ONLY!
         self.preview_mode_non_arduino = False
@@ -92,11 +124,15 @@ class SeriMane:
             self.current_status["alert"]["windows_detected"] = True
 
         else: 
-            # Initialize GPIO for the obstacle sensor
+            # Obstacle sensor (conveyor) and grip sensor, read with edge interrupts instead of polling
             self.sensor_pin = 17  # Use the GPIO number, not the physical pin number
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setup(self.sensor_pin, GPIO.IN)
-            GPIO.setup(18, GPIO.IN)
+            self.grip_pin = 18
+            self.sensors = snm.SensorMane(
+                {"obstacle": self.sensor_pin, "grip": self.grip_pin},
+                debounce_ms=int(self.sysmane.app_config.get("sensor_debounce_ms") or 20),
+            )
+            self.sensors.addListener(self.onSensorEdge)
+            self.current_status["gripdetect"] = self.getGripItemStatus()
             self.log("GPIO setup done", "GPIO", "success")
 
         self.prepare()
@@ -107,14 +143,8 @@ class SeriMane:
     # When destroy is called
     def __del__(self):
         self.closeConnection()
-        if platform.system() != "Linux":
-            if self.obstacle_thread:
-                self.obstacle_thread.join()
-            if self.sensor_thread:
-                self.sensor_thread.join()
-
-            self.obstacle_thread = None
-            self.sensor_thread = None
+        if self.sensors:
+            self.sensors.close()
         
         if self.receive_thread:
             self.receive_thread.join()
@@ -149,12 +179,6 @@ class SeriMane:
                 self.current_status["alert"]["high_disk_usage"] = False
             time.sleep(3)
 
-    def updateGripStatus(self):
-        while True:
-            self.current_status["gripdetect"] = self.getGripItemStatus()
-            # logger.info(f"Grip status: {self.current_status['gripdetect']}")
-            time.sleep(0.5)
-
     def getGripStatus(self):
         return self.current_status["gripdetect"]
     
@@ -168,7 +192,11 @@ class SeriMane:
         if self.arduino_port:
             self.log("Arduino found on port: " + str(self.arduino_port), "Found", "success")
             self.log("Connecting to Arduino with baudrate: " + str(self.sysmane.app_config.get("serial_buadrate")), "Connecting", "debug")
-            self.arduino = serial.Serial(self.arduino_port, self.sysmane.app_config.get("serial_buadrate"), timeout=1)   
+            # No read timeout, the receive thread block in readline until the Arduino send something
+            self.arduino = serial.Serial(self.arduino_port, self.sysmane.app_config.get("serial_buadrate"), timeout=None)
+            # Opening the port reset the Arduino, its instruction counter start again from 0
+            self.resetCommandSeq()
+            self.serial_connected.set()
             self.log("Connected to Arduino", "Connected", "success")
             self.current_status["alert"]["arduino_not_found"] = False
         else:
@@ -183,6 +211,20 @@ class SeriMane:
                 self.current_status["alert"]["arduino_not_found"] = True
 
 
+    def dropConnection(self):
+        # Close the old port so the receive thread leave its blocking readline
+        self.serial_connected.clear()
+        arduino = self.arduino
+        self.arduino = None
+        if isinstance(arduino, serial.Serial):
+            try:
+                arduino.close()
+            except Exception:
+                pass
+        # Nothing will acknowledge the commands sent on the old port
+        self.resetCommandSeq()
+
+
     def setEmergency(self, emergency):
         self.current_status["emergency"] = emergency
         if emergency:
@@ -201,11 +243,10 @@ class SeriMane:
         self.system_thread.daemon = True
         self.system_thread.start()
 
-        # Add thread for updating grip status
-        self.grip_thread = threading.Thread(target=self.updateGripStatus)
-        self.grip_thread.daemon = True
-        self.grip_thread.start()
-
+        # Publish the sensor changes outside of the GPIO interrupt thread
+        self.publish_thread = threading.Thread(target=self.publishChanges)
+        self.publish_thread.daemon = True
+        self.publish_thread.start()
 
         # self.compat_checkCurrentState()
         # self.compat_checkBusy()
@@ -217,10 +258,10 @@ class SeriMane:
             self.current_status["sensor"]["available"] = True
             self.current_status["sensor"]["value"] = False
         else:
-            self.obstacle_thread = threading.Thread(target=self.detectObstacle)
-            self.obstacle_thread.daemon = True
-            self.obstacle_thread.start()
+            # The obstacle sensor is only marked as working after its first detection
+            self.onSensorEdge(self.sensor_pin, self.sensors.getLevel(self.sensor_pin), None)
             self.sensor_thread = threading.Thread(target=self.timeCount)
+            self.sensor_thread.daemon = True
             self.sensor_thread.start()
             
 
@@ -234,32 +275,38 @@ class SeriMane:
         # else:
             # self.sensor_thread.join()``
         
-    def detectObstacle(self):
-        while True:   
-            # Read the digital value from the obstacle sensor
-            if self.current_status["sensor"]["init"] == None or self.current_status["sensor"]["init"] == True :
-                counterout = 0
-                sensor_value = GPIO.input(self.sensor_pin)
-                if sensor_value == GPIO.HIGH:
-                    # self.log("No obstacle detected")
-                    self.current_status["sensor"]["value"] = False
-                    counterout = counterout+1
-                    if counterout == 10:
-                        counterout = 0
-                        self.current_status["sensor"]["init"] = False
-                        self.sensor_thread = threading.Thread(target=self.timeCount)
-                        self.sensor_thread.start()
-                else:
-                    # self.log("Obstacle detected")
-                    self.current_status["sensor"]["init"] = True 
-                    self.current_status["sensor"]["available"] = True
-                    self.current_status["sensor"]["value"] = True
-                    self.current_status["alert"]["sensor_not_working"] = False
-                time.sleep(0.5)  # Adjust the sleep time as needed
+    def onSensorEdge(self, pin, level, timestamp):
+        # Called by SensorMane from the GPIO interrupt thread on every debounced change
+        if pin == self.sensor_pin:
+            if level == GPIO.HIGH:
+                # No obstacle detected
+                self.current_status["sensor"]["value"] = False
             else:
-                logger.error("No sensor")
-                time.sleep(0.5)
-                continue
+                # Obstacle detected
+                self.current_status["sensor"]["init"] = True
+                self.current_status["sensor"]["available"] = True
+                self.current_status["sensor"]["value"] = True
+                self.current_status["alert"]["sensor_not_working"] = False
+        elif pin == self.grip_pin:
+            self.current_status["gripdetect"] = level == GPIO.HIGH
+        # Do not serialize the status here, the GPIO thread must return quickly
+        self.status_changed.set()
+
+    def publishChanges(self):
+        # A burst of edges become one publish
+        while True:
+            self.status_changed.wait()
+            self.status_changed.clear()
+            self.publishStatus()
+
+    def waitForItem(self, timeout=None):
+        # Block until the obstacle sensor see an item on the conveyor, return False on timeout
+        if self.sensors is None:
+            return self.current_status["sensor"]["value"]
+        since = time.monotonic()
+        if self.sensors.getLevel(self.sensor_pin) == GPIO.LOW:
+            return True
+        return self.sensors.waitForEdge(self.sensor_pin, timeout=timeout, level=GPIO.LOW, since=since) is not None
 
     def log(self, message, status=None, level="info"):
         # Store the status
@@ -286,6 +333,11 @@ class SeriMane:
             logger.trace(message)
         else:
             logger.debug(message)
+        self.publishStatus()
+
+    def publishStatus(self):
+        # Push the change to Server Sent Event clients (no-op when nobody is listening)
+        self.sysmane.events.publish("seri_status")
         
     def findArduinoPort(self):
         arduino_vid = '2341'  # Vendor ID of Arduino
@@ -317,7 +369,7 @@ class SeriMane:
         if self.current_status["emergency"]:
             self.log("Emergency mode is activated, cannot send message.", "Emergency", "error")
             # Trying to disconnect from Arduino and reconnect again
-            self.arduino = None
+            self.dropConnection()
             while self.current_status["emergency"]:
                 time.sleep(1)
                 self.log("[!] Emergency mode is activated [!]", "Emergency", "error")
@@ -341,17 +393,22 @@ class SeriMane:
                 if self.extended_log:
                     self.log(f"Sending message to Arduino: {message}", "Sending")
                 # self.log(f"<<-- Message sent to Arduino: {message}", "Sent", "debug")
+                seq, ack = self.trackCommand()
                 try:
-                    self.arduino.write((message + '\n').encode())  # Send the message to Arduino
+                    if isinstance(message, bytes):
+                        self.arduino.write(message)  # Binary frame, already framed
+                    else:
+                        self.arduino.write((message + '\n').encode())  # Send the message to Arduino
                     if self.extended_log:
                         self.log(f"Message sent to Arduino: {message}", "Sent", "success")
                         self.current_status["alert"]["sending_message_failed"] = False
                     return "ok", self.current_status
                 except Exception as e:
+                    self.resolveCommands(seq, False)
                     self.log(f"Error while sending message to Arduino: {e}", "Error", "error")
                     self.current_status["alert"]["sending_message_failed"] = True
                     # Try to reconnect to Arduino
-                    self.arduino = None
+                    self.dropConnection()
                     # Count the retry
                     retry_count = 0
                     while not self.arduino and retry_count < 100:
@@ -374,26 +431,104 @@ class SeriMane:
 
     def receiveMessages(self):
         while True:
-            if self.preview_mode_non_arduino:
+            # Preview mode never open a port, so this block forever instead of spinning
+            self.serial_connected.wait()
+            arduino = self.arduino
+            try:
+                line = arduino.readline().decode(errors="replace").strip()
+            except Exception as e:
+                # Port closed or unplugged, wait for sendMessageToArduino to reconnect
+                self.log(f"Error while receiving message from Arduino: {e}", "Error", "error")
+                if self.arduino is arduino:
+                    self.serial_connected.clear()
                 continue
-            if self.arduino:
-                line = str(self.arduino.readline().decode().strip())
-                # If the line is empty, skip it
-                if not line:
-                    continue
-                if self.extended_log:
-                    self.log(f"-->> Received message from Arduino: {line}", "Received", "debug")
-                # If the line is "Ready!", set isArduinoReady to True
-                if line == "Ready!":
-                    self.current_status["ready"] = True
-                    self.log("Arduino is ready.", "Ready", "success")
-                    # self.checkCurrentState()
-                    # self.checkBusy()
-                    continue
-                # INST{number} is the instruction number start from 0 and increase by 1 every time the instruction is sent
-                if line.startswith("INST"):
-                    self.current_status["instruction"] = line
-                    continue
+            # If the line is empty, skip it
+            if not line:
+                continue
+            if self.extended_log:
+                self.log(f"-->> Received message from Arduino: {line}", "Received", "debug")
+            self.dispatchMessage(line)
+
+    def dispatchMessage(self, line):
+        with self.message_lock:
+            handlers = [
+                callback
+                for prefix, callbacks in self.message_handlers.items()
+                if line.startswith(prefix)
+                for callback in callbacks
+            ]
+        for callback in handlers:
+            try:
+                callback(line)
+            except Exception as e:
+                self.log(f"Error while handling message {line}: {e}", "Error", "exception")
+
+    def onMessage(self, prefix, callback):
+        # Register callback(line) for every line starting with prefix
+        with self.message_lock:
+            self.message_handlers.setdefault(prefix, []).append(callback)
+
+    def onArduinoReady(self, line):
+        # "Ready!" is sent once after the Arduino boot, its instruction counter start again from 0
+        self.resetCommandSeq()
+        self.current_status["ready"] = True
+        self.log("Arduino is ready.", "Ready", "success")
+
+    def onInstruction(self, line):
+        # INST{number} is the instruction number start from 0 and increase by 1 every time the instruction is sent
+        self.current_status["instruction"] = line
+        try:
+            self.resolveCommands(int(line[4:]), True)
+        except ValueError:
+            self.log(f"Invalid instruction number: {line}", "Error", "error")
+        self.publishStatus()
+
+    def resetCommandSeq(self):
+        # Number the next command 0 again and fail the ones still waiting for their INST acknowledgement
+        with self.ack_lock:
+            last_seq = self.command_seq
+            self.command_seq = -1
+        self.resolveCommands(last_seq, False)
+
+    def trackCommand(self):
+        # Number the next line and return (seq, Future resolved by its INST acknowledgement)
+        ack = Future()
+        with self.ack_lock:
+            self.command_seq += 1
+            seq = self.command_seq
+            self.pending_acks[seq] = ack
+        return seq, ack
+
+    def resolveCommands(self, seq, result):
+        # An acknowledgement also cover every older command, the Arduino handle them in order
+        with self.ack_lock:
+            done = [number for number in self.pending_acks if number <= seq]
+            acks = [self.pending_acks.pop(number) for number in done]
+        for ack in acks:
+            if not ack.done():
+                ack.set_result(result)
+
+    def waitIdle(self, timeout=None):
+        # Block until every command sent so far is acknowledged and no trajectory is running
+        # Return False when the Arduino did not answer in time
+        started = time.time()
+        with self.ack_lock:
+            acks = list(self.pending_acks.values())
+            last_seq = self.command_seq
+        finished = True
+        if acks:
+            done, not_done = waitFutures(acks, timeout)
+            if not_done:
+                self.log(f"{len(not_done)} instruction(s) not acknowledged after {timeout}s", "Timeout", "warning")
+                self.resolveCommands(last_seq, False)
+                finished = False
+        # finishMotion pop from motion_waiters on the receive thread
+        with self.motion_lock:
+            motions = list(self.motion_waiters)
+        for seq in motions:
+            remaining = None if timeout is None else max(timeout - (time.time() - started), 0)
+            finished = self.waitMotion(seq, remaining) and finished
+        return finished
     
 
     # def compat_receiveMessages(self):
@@ -458,97 +593,96 @@ class SeriMane:
     #     self.log(f"Instruction sent: {old_format}")
 
 
-    def piInstructionPreset(self, action):
-        instruction = self.sysmane.app_config.get("instructions")
+    def piInstructionPreset(self, action, progress=None):
+        # Presets are compiled by PlanMane at load / reload, nothing is parsed here
+        plan = self.sysmane.plans.presets.get(action)
 
         #Check if the action is in the instruction list if not return error
-        if action not in instruction:
+        if plan is None:
             self.log(f"Action {action} not found in instruction list", "Error", "error")
             return None
-        
-        # Convert to old format
-        # step = instruction[action]["step"]
-        # old_format = ">".join(step) + ">END"
-        
-        # # Send the instruction to Arduino with PX(Instruction)
-        # self.sendMessageToArduino("PX" + old_format)
-        # self.log(f"Instruction sent: {old_format}")    
-
-        # Convert to new format
-        step = instruction[action]["step"]
-        # Put in to the function "translatePiInstruction"
-        # Loop through the step
-        for i in step:
-            #logger.info(f"Converting instruction: {i}")
-            self.translatePiInstruction(i)
-            time.sleep(0.5)
-        self.log(f"Instruction sent: {step}")
 
-    def servoTest(self, action):
-        servotest = self.sysmane.app_config.get("servo_test")
+        self.runPlan(plan, progress)
+        self.log(f"Instruction sent: {action}")
+        return True
 
+    def servoTest(self, action, progress=None):
         #Check if the action is in the servotest list if not return error
         servo = "servo"+str(action)
-        if servo not in servotest:
+        plan = self.sysmane.plans.servo_tests.get(servo)
+        if plan is None:
             self.log(f"Action {servo} not found in servotest list", "Error", "error")
             return None
-        
-        step = servotest[servo]
-        # Put in to the function "translatePiInstruction"
-        # Loop through the step
-        for i in step:
-            #logger.info(f"Converting instruction: {i}")
-            self.translatePiInstruction(i)
-            time.sleep(0.5)
-        self.log(f"Servotest instruction sent: {step}")
 
-    def convTest(self, action):
-        convtest = self.sysmane.app_config.get("conv_test")
+        self.runPlan(plan, progress)
+        self.log(f"Servotest instruction sent: {servo}")
+        return True
 
-        #Check if the action is in the servotest list if not return error
+    def convTest(self, action, progress=None):
+        #Check if the action is in the convtest list if not return error
         conveyor = "conv"+str(action)
-        if conveyor not in convtest:
+        plan = self.sysmane.plans.conv_tests.get(conveyor)
+        if plan is None:
             self.log(f"Action {conveyor} not found in convtest list", "Error", "error")
             return None
-        
-        step = convtest[conveyor]
-        # Put in to the function "translatePiInstruction"
-        # Loop through the step
-        for i in step:
-            #logger.info(f"Converting instruction: {i}")
-            self.translatePiInstruction(i)
+
+        self.runPlan(plan, progress)
+        self.log(f"Convtest instruction sent: {conveyor}")
+        return True
+
+    def runPlan(self, plan, progress=None):
+        # plan is a tuple of ServoGroup (servos moved together) and ConveyorSet
+        # progress(done, total) is called after each step (used by JobMane)
+        for i, entry in enumerate(plan):
+            if isinstance(entry, pmn.ServoGroup):
+                self.setSmoothServos(entry.targets)
+            else:
+                self.setActuators(conveyors={entry.conveyor: (entry.mode, entry.speed)})
+            self.paceStep(entry)
+            if progress:
+                progress(i + 1, len(plan))
+
+    def paceStep(self, entry):
+        # Wait until the step is done before the next one
+        # ack   = the Arduino acknowledged every instruction (INST), then the actuator settle time
+        # model = the last interpolation tick had servo_delay to travel, then the actuator settle time
+        # fixed = 0.5 second after every step (original behaviour)
+        limits = self.sysmane.plans.limits
+        if limits.pacing == "fixed":
             time.sleep(0.5)
-        self.log(f"Convtest instruction sent: {step}")
+            return
+        if limits.pacing == "ack":
+            self.waitIdle(limits.ack_timeout)
+        elif isinstance(entry, pmn.ServoGroup) and self.serial_protocol != "binary":
+            # Binary trajectories already returned on DONE, only the host interpolation need the model
+            time.sleep(limits.delay)
+        if entry.settle:
+            time.sleep(entry.settle)
 
     def translatePiInstruction(self, action):
-        if(action.startswith("S")):
-        #     S0D180 -> set servo 0 to 180 degree
-            servo = int(action[1:3])
-            degree = int(action[4:7])
-            #logger.info(f"[Converted] Setting servo {servo} to {degree} degree")
-            self.setSmoothServo(servo, degree)
-            return None
-        elif(action.startswith("C")):
-        #     C0M1S255 -> set conveyor 0 to mode 1 at speed 255
-            conveyor = int(action[1:2])
-            mode = int(action[3:4])
-            speed = int(action[5:8])
-            #logger.info(f"[Converted] Setting conveyor {conveyor} to mode {mode} at speed {speed}")
-            self.setConveyor(conveyor, mode, speed)
+        # Run a single step string (S00D180, C0M1S255) that is not part of a compiled plan
+        try:
+            parsed = self.sysmane.plans.parseStep(action)
+        except (ValueError, AttributeError) as e:
+            self.log(f"Action {action} is invalid: {e}", "Error", "error")
             return None
+        if parsed[0] == "servo":
+            # S0D180 -> set servo 0 to 180 degree
+            self.setSmoothServo(parsed[1], parsed[2])
         else:
-            self.log(f"Action {action} not found in instruction list", "Error", "error")
-            return None
+            # C0M1S255 -> set conveyor 0 to mode 1 at speed 255
+            self.setConveyor(parsed[1], parsed[2], parsed[3])
+        return None
 
 
     def getGripItemStatus(self):
-        # Get digitalread of pin 18
+        # Get the last level of pin 18 seen by the edge interrupt
         # If HIGH, return True
         # If LOW, return False
-        if platform.system() != "Linux":
+        if self.sensors is None:
             return False
         else:
-            if GPIO.input(18) == GPIO.HIGH:
+            if self.sensors.getLevel(self.grip_pin) == GPIO.HIGH:
                 return True
             else:
                 return False
@@ -557,64 +691,154 @@ class SeriMane:
 
 
 
+    def checkServo(self, servo, degree):
+        # Check if the servo and degree are in range, limits are compiled from the config by PlanMane
+        limits = self.sysmane.plans.limits
+        if servo < 0 or servo > limits.servo_count:
+            self.log(f"Servo {servo} not in range (0, {limits.servo_count})", "Error", "error")
+            return False
+        if degree < limits.min_degree or degree > limits.max_degree:
+            self.log(f"Degree {degree} not in range ({limits.min_degree}, {limits.max_degree})", "Error", "error")
+            return False
+        return True
+
+    def checkConveyor(self, conveyor):
+        limits = self.sysmane.plans.limits
+        if conveyor < 0 or conveyor > limits.conveyor_count:
+            self.log(f"Conveyor {conveyor} not in range (0, {limits.conveyor_count})", "Error", "error")
+            return False
+        return True
+
     def setSmoothServo(self, servo, degree):
-        # Check if the servo is in range
-        if servo < 0 or servo > int(self.sysmane.app_config.get("servo_count")):
-            self.log(f"Servo {servo} not in range (0, {self.sysmane.app_config.get('servo_count')})", "Error", "error")
-            return None
-        if degree < int(self.sysmane.app_config.get("servo_min_degree")) or degree > int(self.sysmane.app_config.get("servo_max_degree")):
-            self.log(f"Degree {degree} not in range ({self.sysmane.app_config.get('servo_min_degree')}, {self.sysmane.app_config.get('servo_max_degree')})", "Error", "error")
+        if not self.checkServo(servo, degree):
             return None
+        return self.setSmoothServos(((servo, degree),))
+
+    def setSmoothServos(self, targets):
+        # Smoothly move several servos at the same time, they all start and arrive together
+        # targets = ((servo, degree), ...) as in ServoGroup, or {servo: degree}
+        # Return True when the move is done, None if a servo or degree is out of range
+        if isinstance(targets, dict):
+            targets = tuple(sorted(targets.items()))
+        for servo, degree in targets:
+            if not self.checkServo(servo, degree):
+                return None
+
+        # The binary firmware interpolate by itself, upload the whole trajectory instead of every degree
+        if self.serial_protocol == "binary":
+            return self.moveServos(**self.syncVelocity(dict(targets))) is not None
 
         # Wait for the arduino to not busy
         while self.current_status["busy"]:
             logger.warning("[Jotto matte!!] Arduino is busy, waiting for 0.2 second...")
             time.sleep(0.2)
 
-        # Smoothly move the servo to the desired degree
-        # Desired degree is the degree that we want to move to
-        desired_degree = degree
-        # Current degree is the current degree of the servo
-        current_degree = self.current_status["servo"][servo]
-        # Step is the number of steps that we want to move
-        step = int(self.sysmane.app_config.get("servo_step"))
-        # Delay is the delay between each step
-        delay = float(self.sysmane.app_config.get("servo_delay"))
-        # Calculate the difference between the desired degree and current degree
-        degree_diff = desired_degree - current_degree
-        #logger.info(f"Servo {servo} at {current_degree} degree, need to move {degree_diff} degree to {desired_degree} degree")
-        
-        # If the difference is 0, do nothing
-        if degree_diff == 0:
-            #logger.info(f"Servo {servo} is already at {desired_degree} degree")
-            self.setServo(servo, desired_degree)
-            return None
-        
-        # If the difference is positive, move clockwise
-        if degree_diff > 0:
-            #logger.info(f"Servo {servo} is moving clockwise")
-            # Loop from current degree to desired degree
-            for i in range(current_degree, desired_degree + 1, step):
-                # Set the servo to the current degree
-                self.setServo(servo, i)
-                # Wait for delay
-                time.sleep(delay)
-
-        # If the difference is negative, move counter-clockwise
-        if degree_diff < 0:
-            #logger.info(f"Servo {servo} is moving counter-clockwise")
-            # Loop from current degree to desired degree
-            for i in range(current_degree, desired_degree - 1, -step):
-                # Set the servo to the current degree
-                self.setServo(servo, i)
-                # Wait for delay
-                time.sleep(delay)
-
-        
-        # Set the servo to the desired degree
-        self.setServo(servo, desired_degree)
+        limits = self.sysmane.plans.limits
+        start = tuple((servo, self.current_status["servo"][servo]) for servo, degree in targets)
+        # Every servo cover its own distance in the same number of ticks as the longest move,
+        # the path of a (start, targets) pair is computed once and cached
+        for tick in pmn.interpolatePath(start, targets, limits.step):
+            if tick:
+                self.setActuators(servos=dict(tick))
+            time.sleep(limits.delay)
+
+        # Set the servos to the desired degree
+        self.setActuators(servos=dict(targets))
         # Set flag to not busy
         self.current_status["busy"] = False
+        return True
+
+    def syncVelocity(self, targets):
+        # Binary mode: pass moveServos one velocity per servo so the shorter moves arrive with the longest one
+        velocity, acceleration = self.getMotionProfile()
+        distances = {servo: abs(degree - self.current_status["servo"][servo]) for servo, degree in targets.items()}
+        longest = max(distances.values()) if distances else 0
+        if not longest:
+            return {"targets": targets}
+        return {
+            "targets": targets,
+            "velocity": {servo: max(velocity * distance / longest, 1) for servo, distance in distances.items()},
+            "acceleration": {servo: max(acceleration * distance / longest, 1) for servo, distance in distances.items()},
+        }
+
+    def getMotionProfile(self):
+        limits = self.sysmane.plans.limits
+        return limits.velocity, limits.acceleration
+
+    def estimateMotionTime(self, distance, velocity, acceleration):
+        # Duration of a trapezoid profile, triangle when the servo never reach the full velocity
+        distance = abs(distance)
+        if distance == 0:
+            return 0
+        if distance <= velocity * velocity / acceleration:
+            return 2 * (distance / acceleration) ** 0.5
+        return distance / velocity + velocity / acceleration
+
+    def nextFrameSeq(self):
+        self.frame_seq = (self.frame_seq + 1) % 256
+        return self.frame_seq
+
+    def moveServos(self, targets, velocity=None, acceleration=None, wait=True):
+        # Upload the trajectory of several servos in one frame, the Arduino does the interpolation
+        # targets = {servo: degree}, velocity and acceleration are a number or {servo: value}
+        # return the trajectory seq or None
+        for servo, degree in targets.items():
+            if not self.checkServo(servo, degree):
+                return None
+        default_velocity, default_acceleration = self.getMotionProfile()
+        velocity = velocity or default_velocity
+        acceleration = acceleration or default_acceleration
+
+        duration = max(
+            self.estimateMotionTime(
+                degree - self.current_status["servo"][servo],
+                velocity[servo] if isinstance(velocity, dict) else velocity,
+                acceleration[servo] if isinstance(acceleration, dict) else acceleration,
+            )
+            for servo, degree in targets.items()
+        ) if targets else 0
+
+        with self.motion_lock:
+            seq = self.nextFrameSeq()
+            done = threading.Event()
+            self.motion_waiters[seq] = done
+        self.current_status["busy"] = True
+        for servo, degree in targets.items():
+            self.current_status["servo"][servo] = int(degree)
+        result = self.sendMessageToArduino(fmn.encodeTrajectoryFrame(seq, targets, velocity, acceleration))
+        if self.preview_mode_non_arduino or not result or result[0] != "ok":
+            # Nothing will answer, do not leave the trajectory pending
+            self.finishMotion(seq)
+        self.publishStatus()
+
+        if wait:
+            self.waitMotion(seq, duration + 1)
+        return seq
+
+    def waitMotion(self, seq, timeout=None):
+        done = self.motion_waiters.get(seq)
+        if done is None:
+            return True
+        if not done.wait(timeout):
+            self.log(f"Trajectory {seq} not reported as done after {timeout}s", "Timeout", "warning")
+            self.finishMotion(seq)
+            return False
+        return True
+
+    def finishMotion(self, seq):
+        try:
+            seq = int(seq)
+        except ValueError:
+            self.log(f"Invalid trajectory number: {seq}", "Error", "error")
+            return
+        with self.motion_lock:
+            done = self.motion_waiters.pop(seq, None)
+            pending = len(self.motion_waiters)
+        if done is not None:
+            done.set()
+        if not pending:
+            self.current_status["busy"] = False
+            self.publishStatus()
 
     # def queueInstruction(self, instruction):
     #     self.current_status["queue"].append(instruction)
@@ -630,70 +854,12 @@ class SeriMane:
 
 
     def setServo(self, servo, degree):
-        # New output serial format is {servo0}{servo1}{servo2}{servo3}{servo4}{servo5}{conv0mode}{conv0speed}{conv1mode}{conv1speed}
-        # Example: 18018018018018018012551255        
-        # Check if the servo is in range
-        if servo < 0 or servo > int(self.sysmane.app_config.get("servo_count")):
-            self.log(f"Servo {servo} not in range (0, {self.sysmane.app_config.get('servo_count')})", "Error", "error")
-            return None
-        if degree < int(self.sysmane.app_config.get("servo_min_degree")) or degree > int(self.sysmane.app_config.get("servo_max_degree")):
-            self.log(f"Degree {degree} not in range ({self.sysmane.app_config.get('servo_min_degree')}, {self.sysmane.app_config.get('servo_max_degree')})", "Error", "error")
-            return None
-
-        # Prepare the output string based on the current status and the desired servo and degree
-        # Example: setServo(0, 180) will set servo 0 to 180 degree
-        # If last status is 17918018018018018012551255
-        # so the output string will be 18018018018018018012551255 (change the first 3 digits)
-
-        # Convert the degree to 3 digits
-        degree = str(degree).zfill(3)
-
-        servo0 = self.current_status["servo"][0]
-        servo1 = self.current_status["servo"][1]
-        servo2 = self.current_status["servo"][2]
-        servo3 = self.current_status["servo"][3]
-        servo4 = self.current_status["servo"][4]
-        servo5 = self.current_status["servo"][5]
-        servo6 = self.current_status["servo"][6]
-        conv0mode = self.current_status["conv"]["mode"][0]
-        conv0speed = self.current_status["conv"]["speed"][0]
-        conv1mode = self.current_status["conv"]["mode"][1]
-        conv1speed = self.current_status["conv"]["speed"][1]
-
-
-        if servo == 0:
-            servo0 = degree
-        elif servo == 1:
-            servo1 = degree
-        elif servo == 2:
-            servo2 = degree
-        elif servo == 3:
-            servo3 = degree
-        elif servo == 4:
-            servo4 = degree
-        elif servo == 5:
-            servo5 = degree
-        elif servo == 6:
-            servo6 = degree
-        else:
-            self.log(f"Servo {servo} not in range (0, {self.sysmane.app_config.get('servo_count')})", "Error", "error")
-            return None
-        
-        output = f"{str(servo0).zfill(3)}{str(servo1).zfill(3)}{str(servo2).zfill(3)}{str(servo3).zfill(3)}{str(servo4).zfill(3)}{str(servo5).zfill(3)}{str(servo6).zfill(3)}{conv0mode}{str(conv0speed).zfill(3)}{conv1mode}{str(conv1speed).zfill(3)}"
-        
-        # Set current_status["servo"] to the new degree
-        self.current_status["servo"][servo] = int(degree)
-
-        # Send the instruction to Arduino
-        self.sendMessageToArduino(output)
+        return self.setActuators(servos={servo: degree})
 
 
     def setConveyor(self, conveyor, mode=None, speed=None):
-        # New output serial format is {servo0}{servo1}{servo2}{servo3}{servo4}{servo5}{conv0mode}{conv0speed}{conv1mode}{conv1speed}
-        # Example: 18018018018018018012551255        
         # Check if the conveyor is in range
-        if conveyor < 0 or conveyor > int(self.sysmane.app_config.get("conveyor_count")):
-            self.log(f"Conveyor {conveyor} not in range (0, {self.sysmane.app_config.get('conveyor_count')})", "Error", "error")
+        if not self.checkConveyor(conveyor):
             return None
         if mode is None and speed is None:
             self.log(f"Conveyor {conveyor} is not set", "Error", "error")
@@ -702,40 +868,43 @@ class SeriMane:
             mode = self.current_status["conv"]["mode"][conveyor]
         if speed is None:
             speed = self.current_status["conv"]["speed"][conveyor]
-
-        servo0 = self.current_status["servo"][0]
-        servo1 = self.current_status["servo"][1]
-        servo2 = self.current_status["servo"][2]
-        servo3 = self.current_status["servo"][3]
-        servo4 = self.current_status["servo"][4]
-        servo5 = self.current_status["servo"][5]
-        servo6 = self.current_status["servo"][6]
-
-        conv0mode = self.current_status["conv"]["mode"][0]
-        conv0speed = self.current_status["conv"]["speed"][0]
-        conv1mode = self.current_status["conv"]["mode"][1]
-        conv1speed = self.current_status["conv"]["speed"][1]
-
-        # Prepare the output string based on the current status and the desired servo and degree
-        if conveyor == 0:
-            conv0mode = mode
-            conv0speed = speed
-        elif conveyor == 1:
-            conv1mode = mode
-            conv1speed = speed
-        else:
-            self.log(f"Conveyor {conveyor} not in range (0, {self.sysmane.app_config.get('conveyor_count')})", "Error", "error")
-            return None
-        
-
-        output = f"{str(servo0).zfill(3)}{str(servo1).zfill(3)}{str(servo2).zfill(3)}{str(servo3).zfill(3)}{str(servo4).zfill(3)}{str(servo5).zfill(3)}{str(servo6).zfill(3)}{conv0mode}{str(conv0speed).zfill(3)}{conv1mode}{str(conv1speed).zfill(3)}"
-
-        # Set current_status["conv"] to the new mode and speed
-        self.current_status["conv"]["mode"][conveyor] = mode
-        self.current_status["conv"]["speed"][conveyor] = speed
+        return self.setActuators(conveyors={conveyor: (mode, speed)})
+
+
+    def setActuators(self, servos=None, conveyors=None):
+        # Update several servos and conveyors with a single message
+        # servos = {servo: degree}, conveyors = {conveyor: (mode, speed)}
+        servos = servos or {}
+        conveyors = conveyors or {}
+        for servo, degree in servos.items():
+            if not self.checkServo(servo, degree):
+                return None
+        for conveyor in conveyors:
+            if not self.checkConveyor(conveyor):
+                return None
+
+        # Set current_status to the new degree, mode and speed
+        for servo, degree in servos.items():
+            self.current_status["servo"][servo] = int(degree)
+        for conveyor, (mode, speed) in conveyors.items():
+            self.current_status["conv"]["mode"][conveyor] = mode
+            self.current_status["conv"]["speed"][conveyor] = speed
 
         # Send the instruction to Arduino
-        self.sendMessageToArduino(output)
+        if self.serial_protocol == "binary":
+            output = fmn.encodeStateFrame(self.nextFrameSeq(), servos, conveyors)
+        else:
+            output = self.buildAsciiState()
+        result = self.sendMessageToArduino(output)
+        self.publishStatus()
+        return result
+
+    def buildAsciiState(self):
+        # ASCII serial format is {servo0}..{servo6}{conv0mode}{conv0speed}{conv1mode}{conv1speed}
+        # Example: 08007508007500004500012551255
+        servo = self.current_status["servo"]
+        conv = self.current_status["conv"]
+        return "".join(str(degree).zfill(3) for degree in servo) + f"{conv['mode'][0]}{str(conv['speed'][0]).zfill(3)}{conv['mode'][1]}{str(conv['speed'][1]).zfill(3)}"
 
 
     # def compat_setServo(self, servo, degree):
@@ -0,0 +1,213 @@
+import threading
+import queue
+import time
+import cv2
+from loguru import logger
+
+
+class StreamSubscriber:
+    """Per-client mailbox that only keeps the newest JPEG chunk"""
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=1)
+        self.dropped = 0
+
+    def push(self, chunk):
+        # Never block the encoder, replace the old chunk if the client is slow
+        try:
+            self.queue.put_nowait(chunk)
+        except queue.Full:
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(chunk)
+            except queue.Full:
+                pass
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class StreamChannel:
+    """Encode each new frame of one stream variant once and fan it out to all subscribers"""
+    def __init__(self, name, render, interval=0.2, placeholder_interval=5):
+        self.name = name
+        self.render = render
+        self.interval = interval
+        self.placeholder_interval = placeholder_interval
+
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.thread = None
+        self.last_chunk = None
+        self.last_key = None
+        self.last_publish = 0
+        self.placeholder_cache = {}
+
+        self.status = {
+            "subscribers": 0,
+            "encoded": 0,
+            "dropped": 0,
+            "encode_time": 0,
+        }
+
+    def subscribe(self):
+        subscriber = StreamSubscriber()
+        with self.lock:
+            self.subscribers.append(subscriber)
+            self.status["subscribers"] = len(self.subscribers)
+            # Send the latest chunk right away so a new client does not wait for the next frame
+            if self.last_chunk is not None:
+                subscriber.push(self.last_chunk)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+                logger.debug(f"[StreamMane] Start {self.name} broadcaster")
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                self.status["dropped"] += subscriber.dropped
+            self.status["subscribers"] = len(self.subscribers)
+
+    def publish(self, key, chunk):
+        with self.lock:
+            self.last_key = key
+            self.last_chunk = chunk
+            self.last_publish = time.time()
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.push(chunk)
+
+    def encode(self, frame):
+        t1 = time.perf_counter()
+        (flag, encodedImage) = cv2.imencode(".jpg", frame)
+        if not flag:
+            return None
+        self.status["encoded"] += 1
+        self.status["encode_time"] = time.perf_counter() - t1
+        return (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
+            encodedImage.tobytes() + b'\r\n')
+
+    def getPlaceholder(self, path):
+        # Placeholder images never change, so encode them only once
+        if path not in self.placeholder_cache:
+            frame = cv2.imread(path)
+            if frame is None:
+                logger.error(f"[StreamMane] Can not read placeholder image: {path}")
+                return None
+            self.placeholder_cache[path] = self.encode(frame)
+        return self.placeholder_cache[path]
+
+    def run(self):
+        while True:
+            started = time.time()
+            with self.lock:
+                if not self.subscribers:
+                    # Nobody is watching, stop encoding until the next client connects
+                    self.thread = None
+                    self.last_key = None
+                    logger.debug(f"[StreamMane] Stop {self.name} broadcaster")
+                    return
+
+            try:
+                kind, key, source = self.render(self.last_key)
+                if kind == "image":
+                    # Resend the placeholder when the state changes or every placeholder_interval
+                    if key != self.last_key or time.time() - self.last_publish >= self.placeholder_interval:
+                        chunk = self.getPlaceholder(source)
+                        if chunk is not None:
+                            self.publish(key, chunk)
+                elif key != self.last_key:
+                    chunk = self.encode(source)
+                    if chunk is not None:
+                        self.publish(key, chunk)
+            except Exception as e:
+                logger.error(f"[StreamMane] Error when encode {self.name} stream: {e}")
+
+            # interval is the fastest rate of this variant, the render already waited for a new frame
+            remaining = self.interval - (time.time() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+class StreamMane:
+    def __init__(self, sysmane, tfmane):
+        self.sysmane = sysmane
+        self.tfmane = tfmane
+        self.channels = {
+            "raw": StreamChannel("raw", self.renderRaw, interval=0.2),
+            "predict": StreamChannel("predict", self.renderPredict, interval=0.4),
+        }
+
+    def getStatus(self):
+        return {name: channel.status for name, channel in self.channels.items()}
+
+    def subscribe(self, variant):
+        # Generator used by StreamingResponse, each client only waits on its own mailbox
+        channel = self.channels[variant]
+        subscriber = channel.subscribe()
+        try:
+            while True:
+                chunk = subscriber.get(timeout=1)
+                if chunk is None:
+                    continue
+                yield chunk
+        finally:
+            channel.unsubscribe(subscriber)
+
+    def renderRaw(self, last_key=None):
+        video = self.tfmane.video
+        # If camera is not available, use no_camera_image (in config) instead
+        if not video:
+            return "image", "no_camera", self.sysmane.app_config.get("no_camera_image")
+        # Block until the camera capture a frame newer than the one already sent
+        after_id = None
+        if isinstance(last_key, tuple) and last_key[0] == id(video):
+            after_id = last_key[1]
+        frame_id, frame = video.waitForFrame(after_id, timeout=1)
+        if frame is None and after_id is not None:
+            return "frame", last_key, None
+        if frame is None:
+            return "image", "no_camera", self.sysmane.app_config.get("no_camera_image")
+        # Key by camera and frame id, so the same frame is never encoded twice
+        return "frame", (id(video), frame_id), frame
+
+    def renderPredict(self, last_key=None):
+        if self.tfmane.current_status['camera_running'] == False:
+            return "image", "pause_camera", self.sysmane.app_config.get("pause_camera_image")
+        kind, key, frame = self.renderRaw(last_key)
+        if kind == "image" or key == last_key:
+            # Same frame as the last one, the broadcaster will not encode it so skip the drawing too
+            return kind, key, frame
+
+        status = self.sysmane.getCurrentResult()
+        # Draw on a copy, the captured frame is shared with the raw stream and detection
+        frame = frame.copy()
+        box = status['box']
+        if box:
+            for key_box, value in box.items():
+                xmin = value['xmin']
+                ymin = value['ymin']
+                xmax = value['xmax']
+                ymax = value['ymax']
+                labelSize = value['labelSize']
+                baseLine = value['baseLine']
+                label_ymin = value['label_ymin']
+                label = '%s: %d%%' % (value['object_name'], value['persent_scores'])
+                # Draw box
+                cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), (10, 255, 0), 2)
+                cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), (255, 255, 255), cv2.FILLED) # Draw white box to put label text in
+                cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+
+        # Draw Prediction FPS
+        cv2.putText(frame,'PFPS: {0:.2f}'.format(status['fps']),(30,50),cv2.FONT_HERSHEY_SIMPLEX,1,(255,255,0),2,cv2.LINE_AA)
+        return "frame", key, frame
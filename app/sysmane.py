@@ -5,9 +5,13 @@ from loguru import logger
 try:
     #import TFmane as tfm
     import conmane as cmn
+    import eventmane as emn
+    import planmane as pmn
 except:
     #from app import TFmane as tfm
     from app import conmane as cmn
+    from app import eventmane as emn
+    from app import planmane as pmn
 
 class SysMane:
     def __init__(self):
@@ -16,6 +20,12 @@ class SysMane:
         self.config_path = os.path.join(self.userdata_path, "config")
         self.current_path = os.getcwd()
         self.app_config = cmn.ConfigMane("config.json", self.config_path)
+        # Motion config compiled once, a bad step stop the start instead of failing in the middle of a run
+        try:
+            self.plans = pmn.PlanMane(self.app_config)
+        except ValueError as e:
+            logger.error("Invalid motion config: {}".format(e))
+            raise
         self.current_model = self.app_config.get("current_model")
         self.running = {
             "current_result": None,
@@ -25,12 +35,23 @@ class SysMane:
             "fps" : 0,
             "box" : None,
         }
+        # Status hub for Server Sent Event, every manager publish their status change here
+        self.events = emn.EventMane()
 
     def getConfig(self):
         return self.app_config
     
     def reloadConfig(self):
-        self.app_config.reload()
+        # Raise ValueError and keep the previous config and plans if the new config is not valid JSON or has a bad step
+        # (the endpoints and ArmMane read app_config, it must always match the compiled plans)
+        previous = self.app_config.config
+        try:
+            self.app_config.reload()
+            self.plans.compile()
+        except ValueError as e:
+            self.app_config.config = previous
+            logger.error("Invalid config, keep the previous config and plans: {}".format(e))
+            raise
         logger.info("Reload user config")
     
     def getCurrentModel(self):
@@ -45,7 +66,7 @@ class SysMane:
     def setCurrentModel(self, model_name):
         self.current_model = model_name
         self.app_config.change("current_model", model_name)
-        self.app_config.save_config()
+        self.app_config.saveConfig()
 
     def listModelFolder(self):
         logger.info("List model folder: {}".format(self.app_config.get("model_folder")))
@@ -85,6 +106,7 @@ class SysMane:
 
     def setCurrentResult(self, result):
         self.running = result
+        self.events.publish("prediction")
 
     def setCurrentBox(self, box):
         self.running["box"] = box
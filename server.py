@@ -10,13 +10,15 @@ from app import armmane
 from app import sysmane
 from app import serimane
 from app import TFmane
+from app import streammane
+from app import bootmane
+from app import jobmane
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 from fastapi.responses import JSONResponse
 from loguru import logger
 import json
-import copy
 import cv2
 # SSE
 import asyncio
@@ -24,6 +26,7 @@ from sse_starlette.sse import EventSourceResponse
 from starlette.responses import StreamingResponse
 import sys
 import time
+import re
 
 
 
@@ -92,6 +95,50 @@ origins = [
     'https://design.nicezki.com',
 ]
 
+# Subsystems needed by each endpoint (first match win), the other endpoints work during startup
+required_subsystems = [
+    (r"^/status/seri", ["seri"]),
+    (r"^/status/arm", ["arm"]),
+    (r"^/status/stream", ["tf"]),
+    (r"^/command/sorting", ["arm"]),
+    (r"^/command/", ["seri"]),
+    (r"^/test/", ["seri"]),
+    (r"^/(mode|item|flag)/", ["arm"]),
+    (r"^/(camera|detect|stream)", ["tf"]),
+    (r"^/model/[^/]+/benchmark", ["tf"]),
+    (r"^/config/currentmodel", ["tf"]),
+]
+
+
+class SubsystemReadyMiddleware:
+    """Answer 503 to the endpoints whose subsystem is still starting, the other requests pass through untouched"""
+    # Pure ASGI, so the video streams and the Server Sent Events are not wrapped by BaseHTTPMiddleware
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for pattern, subsystems in required_subsystems:
+                if re.match(pattern, scope["path"]):
+                    not_ready = [subsystem for subsystem in subsystems if not boot.isReady(subsystem)]
+                    if not_ready:
+                        response = JSONResponse(
+                            status_code=503,
+                            content={
+                                "status": "error",
+                                "message": "{} is not ready yet".format(", ".join(not_ready)),
+                                "startup": boot.getStatus()
+                            }
+                        )
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+# Added before CORSMiddleware so CORS wrap it and the 503 answer also carry the CORS headers
+app.add_middleware(SubsystemReadyMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -101,9 +148,98 @@ app.add_middleware(
 )
 
 sys = sysmane.SysMane()
-seri = serimane.SeriMane(sys)
-tmn = TFmane.TFMane(sys)
-amn = armmane.ArmMane(sys, seri,tmn)
+# SeriMane wait for the Arduino and TFMane probe the camera and load the model, so they are started in background
+# The API is available right away, endpoints that need a subsystem answer 503 until it is ready
+seri = None
+tmn = None
+amn = None
+stm = None
+boot = bootmane.BootMane()
+# Motion commands run in this executor, the endpoints only return a job id so the event loop never block
+jobs = jobmane.JobMane(sys.events, reason=lambda: seri.current_status["message"] if seri else None)
+
+
+def getAlert():
+    # Get alert from all class (arm, seri, tf) by calling method getAlert(), None when it is not started yet
+    return {
+        "arm": amn.getAlert() if amn else None,
+        "seri": seri.getAlert() if seri else None,
+        "tf": tmn.getAlert() if tmn else None
+    }
+
+
+def startSeri():
+    global seri
+    seri = serimane.SeriMane(sys)
+    sys.events.register("seri_status", seri.getCurrentStatus)
+
+
+def startTF():
+    global tmn, stm
+    tmn = TFmane.TFMane(sys)
+    stm = streammane.StreamMane(sys, tmn)
+
+
+def startArm():
+    global amn
+    amn = armmane.ArmMane(sys, seri, tmn)
+    sys.events.register("arm_status", amn.getCurrentStatus)
+
+
+# Register the status sources of Server Sent Event, each change is serialized once for all clients
+sys.events.register("alert_status", getAlert)
+sys.events.register("prediction", sys.getCurrentResult)
+sys.events.register("startup", boot.getStatus)
+sys.events.register("jobs", jobs.getStatus)
+
+boot.start("seri", startSeri)
+boot.start("tf", startTF)
+boot.start("arm", startArm, requires=["seri", "tf"])
+
+
+@app.get("/status/startup", tags=["Status"], description="Return readiness and startup time of each subsystem")
+async def status_startup():
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": "Return status of startup",
+            "status_startup": boot.getStatus()
+        }
+    )
+
+
+@app.get("/jobs", tags=["Status"], description="Return the latest motion jobs, also sent as the jobs Server Sent Event")
+async def jobs_list():
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": "Return status of jobs",
+            "status_jobs": jobs.getStatus()
+        }
+    )
+
+
+@app.get("/jobs/{job_id}", tags=["Status"], description="Return state, progress and timing of a motion job")
+async def job_status(job_id: int):
+    job = jobs.getJob(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "status": "error",
+                "message": "Job {} not found".format(job_id)
+            }
+        )
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": "Return status of job {}".format(job_id),
+            "job": job
+        }
+    )
 
 
 @app.get("/info", tags=["Info"])
@@ -118,7 +254,8 @@ async def root():
                 "current_model_config": sys.getCurrentModelConfig().getAll(),
                 "current_model_path": sys.getModelPath(sys.getCurrentModel()),
                 "models": sys.listModelFolder()
-            }
+            },
+            "startup": boot.getStatus()
         }
     )
 
@@ -136,7 +273,16 @@ async def config():
 
 @app.get("/config/reload", tags=["Config"], description="Reload user config data used in ArmMane")
 async def config_reload():
-    sys.reloadConfig()
+    try:
+        sys.reloadConfig()
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": "Invalid config, previous config and plans are still used: {}".format(e)
+            }
+        )
     return JSONResponse(
         status_code=200,
         content={
@@ -159,12 +305,20 @@ async def config_currentmodel(key: str):
                 "message": "Model not found"
             }
         )
-    sys.setCurrentModel(key)
+    # Load and warm the model in background, detection keep running with the old model until the swap
+    if not tmn.switchModel(key):
+        return JSONResponse(
+            status_code=409,
+            content={
+                "status": "error",
+                "message": "Another model is still loading"
+            }
+        )
     return JSONResponse(
         status_code=200,
         content={
             "status": "success",
-            "message": "Set current model to {}".format(key)
+            "message": "Switching current model to {}, see model_swap in /status/prediction".format(key)
         }
     )
 
@@ -190,6 +344,66 @@ async def model_config(model_name: str):
     )
 
 
+@app.post("/model/{model_name}/benchmark", tags=["Model"], description="Benchmark the model with each interpreter thread setting and return p50/p95 latency")
+def model_benchmark(model_name: str, runs: int = 50, threads: str = "1,2,3,4"):
+    # Plain def so FastAPI run it in the threadpool, the benchmark take a while
+    if model_name not in sys.listModelFolder():
+        return JSONResponse(
+            status_code=404,
+            content={
+                "status": "error",
+                "message": "Model not found"
+            }
+        )
+    try:
+        thread_list = [int(thread) for thread in threads.split(",")]
+    except ValueError:
+        thread_list = []
+    if runs < 1 or not thread_list or min(thread_list) < 1:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": "Runs and threads must be more than 0 (threads example: 1,2,4)"
+            }
+        )
+    # runs and threads are clamped by benchmarkModel (see BENCHMARK_MAX_* in TFmane.py)
+    try:
+        report = tmn.benchmarkModel(model_name, runs=runs, threads=thread_list)
+    except FileNotFoundError as e:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "status": "error",
+                "message": str(e)
+            }
+        )
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": str(e)
+            }
+        )
+    if report is None:
+        return JSONResponse(
+            status_code=409,
+            content={
+                "status": "error",
+                "message": "Another benchmark is running"
+            }
+        )
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": "Benchmark of {}".format(model_name),
+            "benchmark": report
+        }
+    )
+
+
 @app.get("/status/arm", tags=["Status"], description="Return current status of arm ")
 async def status_arm():
     return JSONResponse(
@@ -224,12 +438,7 @@ async def status_prediction():
 
 @app.get("/status/alert", tags=["Status"], description="Return current alert status of all system.")
 async def status_alert():
-    # Get alert from all class (arm, seri, tf) by calling method getAlert()
-    alert = {
-        "arm": amn.getAlert(),
-        "seri": seri.getAlert(),
-        "tf": tmn.getAlert()
-    }
+    alert = getAlert()
     
     return JSONResponse(
         status_code=200,
@@ -261,12 +470,13 @@ async def command_servo(servo: int, angle: int):
                 "message": "Angle must be between {} and {}".format(sys.app_config.get("servo_min_degree"), sys.app_config.get("servo_max_degree"))
             }
         )
-    seri.setSmoothServo(servo, angle)
+    job_id = jobs.submit("servo {} to {}".format(servo, angle), seri.setSmoothServo, servo, angle)
     return JSONResponse(
-        status_code=200,
+        status_code=202,
         content={
             "status": "success",
-            "message": "Set servo {} to {}".format(servo, angle)
+            "message": "Set servo {} to {}, see /jobs/{}".format(servo, angle, job_id),
+            "job_id": job_id
         }
     )
 
@@ -353,7 +563,7 @@ async def change_type(current_type: int = 0):
 @app.post("/command/preset/{preset}", tags=["Command"], description="Run the preset instruction to control the arm")
 async def command_preset(preset: str):
     # Check if preset is in list of instruction
-    if preset not in sys.app_config.get("instructions"):
+    if preset not in sys.plans.presets:
         return JSONResponse(
             status_code=404,
             content={
@@ -361,12 +571,13 @@ async def command_preset(preset: str):
                 "message": "Preset not found"
             }
         )
-    seri.piInstructionPreset(preset)
+    job_id = jobs.submit("preset {}".format(preset), seri.piInstructionPreset, preset, with_progress=True)
     return JSONResponse(
-        status_code=200,
+        status_code=202,
         content={
             "status": "success",
-            "message": "Set preset {}".format(preset)
+            "message": "Set preset {}, see /jobs/{}".format(preset, job_id),
+            "job_id": job_id
         }
     )
 
@@ -458,6 +669,18 @@ async def camera_stop():
 
 
 
+@app.post("/camera/rescan", tags=["Status"], description="Scan the camera devices again (e.g. after plugging a camera)")
+def camera_rescan():
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": "Rescan camera",
+            "camera": tmn.rescanCamera()
+        }
+    )
+
+
 @app.post("/camera/{id}", tags=["Status"], description="Set camera ID to use")
 async def camera(id: int):
     # If camera is not in list of cameras in tfm.camera_list
@@ -544,6 +767,32 @@ async def detect_start():
         }
     )
 
+@app.post("/detect/mode/{mode}", tags=["Status"], description="Set detection scheduler mode (max, target_fps or on_demand), target_fps is used by target_fps mode")
+async def detect_mode(mode: str, target_fps: float = None):
+    if mode not in tmn.detect_modes:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": "Mode must be one of {}".format(", ".join(tmn.detect_modes))
+            }
+        )
+    if not tmn.setDetectMode(mode, target_fps):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": "Target fps must be more than 0"
+            }
+        )
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": "Set detect mode to {} (target fps: {})".format(mode, tmn.target_fps)
+        }
+    )
+
 @app.post("/detect/stop", tags=["Status"], description="Stop object detection")
 async def detect_stop():
     # Stop object detection
@@ -567,12 +816,21 @@ async def servo_test(servo: int):
                 "message": "Servo must be between 0 and {}".format(sys.app_config.get("servo_count"))
             }
         )
-    seri.servoTest(servo)
+    if "servo" + str(servo) not in sys.plans.servo_tests:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "status": "error",
+                "message": "No servo_test for servo {}".format(servo)
+            }
+        )
+    job_id = jobs.submit("test servo {}".format(servo), seri.servoTest, servo, with_progress=True)
     return JSONResponse(
-        status_code=200,
+        status_code=202,
         content={
             "status": "success",
-            "message": "Test servo {}".format(servo)
+            "message": "Test servo {}, see /jobs/{}".format(servo, job_id),
+            "job_id": job_id
         }
     )
 
@@ -587,12 +845,21 @@ async def conv_test(conv: int):
                 "message": "Conv must be between 0 and {}".format(sys.app_config.get("conveyor_count"))
             }
         )
-    seri.convTest(conv)
+    if "conv" + str(conv) not in sys.plans.conv_tests:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "status": "error",
+                "message": "No conv_test for conv {}".format(conv)
+            }
+        )
+    job_id = jobs.submit("test conv {}".format(conv), seri.convTest, conv, with_progress=True)
     return JSONResponse(
-        status_code=200,
+        status_code=202,
         content={
             "status": "success",
-            "message": "Test conv {}".format(conv)
+            "message": "Test conv {}, see /jobs/{}".format(conv, job_id),
+            "job_id": job_id
         }
     )
 @app.post("/test/sensor/grip", tags=["Test"], description="Testing grip sensor")
@@ -635,78 +902,17 @@ async def item(box: int, item: int):
         }
     )
 
-async def event_generator(request: Request):
-    last_seri_status = {}
-    last_arm_status = {}
-    last_alert_status = {}
-    last_pred_status = {}
-    yield {
-        # Send connected message to client
-        "data": json.dumps({"status": "connected"})
-    }
-    while True:
-        # If client closes connection, stop sending events
-        if await request.is_disconnected():
-            break
-        # Check if status changed
-        current_seri_status = seri.getCurrentStatus()
-        current_arm_status = amn.getCurrentStatus()
-        current_pred_status = sys.getCurrentResult()
-
-        alert = {
-        "arm": amn.getAlert(),
-        "seri": seri.getAlert(),
-        "tf": tmn.getAlert()
-        }
-
-        current_alert_status = copy.deepcopy(alert)
-
-
-
-
-        # print("current_status")
-        # print(current_status['servo'])
-        # print("last_status")
-        # print(last_status['servo'])
-        
-        # Compare individual keys and values
-        if last_alert_status != current_alert_status:
-            # If client reconnects or status changes, send current_status to client
-            last_alert_status = copy.deepcopy(current_alert_status)
-            yield {
-                "event": "alert_status",
-                "data": json.dumps(current_alert_status)
-            }
-
-        if last_seri_status != current_seri_status:
-            # If client reconnects or status changes, send current_seri_status to client
-            last_seri_status = copy.deepcopy(current_seri_status)
-            yield {
-                "event": "seri_status",
-                "data": json.dumps(current_seri_status)
-            }
-        if last_arm_status != current_arm_status:
-            # If client reconnects or status changes, send current_arm_status to client
-            last_arm_status = copy.deepcopy(current_arm_status)
-            yield {
-                "event": "arm_status",
-                "data": json.dumps(current_arm_status)
-            }
-
-        if last_pred_status != current_pred_status:
-            # If client reconnects or status changes, send current_pred_status to client
-            last_pred_status = copy.deepcopy(current_pred_status)
-            yield {
-                "event": "prediction",
-                "data": json.dumps(current_pred_status)
+@app.get('/sse/status', tags=["Server Sent Event"], description="Server Sent Event to send arm status to client. Use mode=patch to receive \"<event>_patch\" JSON-patch diffs with a periodic full keyframe")
+async def sse_status_stream(request: Request, mode: str = "full"):
+    if mode not in ["full", "patch"]:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": "Mode must be full or patch"
             }
-
-        await asyncio.sleep(0.1)
-
-
-@app.get('/sse/status', tags=["Server Sent Event"], description="Server Sent Event to send arm status to client")
-async def sse_status_stream(request: Request):
-    return EventSourceResponse(event_generator(request))
+        )
+    return EventSourceResponse(sys.events.stream(request, mode))
 
 # Run the server by typing this command in the terminal:
 # python -m uvicorn server:app --reload
@@ -714,145 +920,23 @@ async def sse_status_stream(request: Request):
 
 @app.get("/stream/video", tags=["StreamingResponse"], description="Better way to get the video stream from ARMMANE camera")
 async def get_video_stream():
-    def generate():
-        while True:
-            # If camera is not available, use no_camera_image (in config) instead
-            if not tmn.video:
-                frame = cv2.imread(sys.app_config.get("no_camera_image"))
-                # encode the frame in JPEG format
-                (flag, encodedImage) = cv2.imencode(".jpg", frame)
-                # ensure the frame was successfully encoded
-                if not flag:
-                    continue
-                # yield the output frame in the byte format
-                yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
-                    bytearray(encodedImage) + b'\r\n')
-                time.sleep(5)
-                continue
-
-
-            frame = tmn.video.read()
-
-            # encode the frame in JPEG format
-            (flag, encodedImage) = cv2.imencode(".jpg", frame)
-            # ensure the frame was successfully encoded
-            if not flag:
-                continue
-            # yield the output frame in the byte format
-            yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
-                bytearray(encodedImage) + b'\r\n')
-            
-            time.sleep(0.2)
-
-    return StreamingResponse(generate(), media_type="multipart/x-mixed-replace; boundary=frame")
+    # Every client shares the same encoded JPEG from the raw broadcaster
+    return StreamingResponse(stm.subscribe("raw"), media_type="multipart/x-mixed-replace; boundary=frame")
 
 
 @app.get("/stream/video2", tags=["StreamingResponse"], description="Better way to get the video stream from ARMMANE camera (with prediction)")
-async def get_video_stream():
-    def generate():
-        while True:
-            # If camera is not available, use no_camera_image (in config) instead
-            # if not tmn.video:
-            if tmn.current_status['camera_running'] == False:
-                frame = cv2.imread(sys.app_config.get("pause_camera_image"))
-                # encode the frame in JPEG format
-                (flag, encodedImage) = cv2.imencode(".jpg", frame)
-                # ensure the frame was successfully encoded
-                if not flag:
-                    continue
-                # yield the output frame in the byte format
-                yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
-                    bytearray(encodedImage) + b'\r\n')
-                time.sleep(5)
-                continue
-
-
-            if not tmn.video:
-                frame = cv2.imread(sys.app_config.get("no_camera_image"))
-                # encode the frame in JPEG format
-                (flag, encodedImage) = cv2.imencode(".jpg", frame)
-                # ensure the frame was successfully encoded
-                if not flag:
-                    continue
-                # yield the output frame in the byte format
-                yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
-                    bytearray(encodedImage) + b'\r\n')
-                time.sleep(5)
-                continue
-        
-            # t1 = cv2.getTickCount()
-            frame = tmn.video.read()
-
-            # From tfm:
-            # self.current_status['box'] = {
-            #     "box-1": {
-            #         "xmin": xmin,
-            #         "ymin": ymin,
-            #         "xmax": xmax,
-            #         "ymax": ymax,
-            #         "label": label,
-            #         "labelSize": labelSize,
-            #         "baseLine": baseLine,
-            #         "label_ymin": label_ymin,
-            #         "object_name": object_name,
-            #         "persent_scores": persent_scores
-            #     },
-            #     "box-2": {
-            #    ...
-            #     }
-            
-
-            status = sys.getCurrentResult()
-            box = status['box']
-
-            # Add box to frame if box is not empty
-            if box:
-                for key, value in box.items():
-                    xmin = value['xmin']
-                    ymin = value['ymin']
-                    xmax = value['xmax']
-                    ymax = value['ymax']
-                    label = value['label']
-                    labelSize = value['labelSize']
-                    baseLine = value['baseLine']
-                    label_ymin = value['label_ymin']
-                    object_name = value['object_name']
-                    persent_scores = value['persent_scores']
-                    label = '%s: %d%%' % (object_name, persent_scores)
-                    # Draw box
-                    # cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), (10, 255, 0), 2)
-                    #cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), (255, 255, 255), cv2.FILLED) # Draw white box to put label text in
-                    #cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2) # Draw label text
-
-                    # Draw box
-                    cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), (10, 255, 0), 2)
-                    cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), (255, 255, 255), cv2.FILLED) # Draw white box to put label text in
-                    cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-
-
-            # Draw Prediction FPS
-            cv2.putText(frame,'PFPS: {0:.2f}'.format(status['fps']),(30,50),cv2.FONT_HERSHEY_SIMPLEX,1,(255,255,0),2,cv2.LINE_AA)
-            
-            # Draw Real FPS
-            # Calculate framerate
-            # freq = cv2.getTickFrequency()
-
-            # t2 = cv2.getTickCount()
-            # time1 = (t2-t1)/freq
-            # frame_rate_calc= 1/time1
-            # cv2.putText(frame,'RFPS: {0:.2f}'.format(frame_rate_calc),(30,80),cv2.FONT_HERSHEY_SIMPLEX,1,(255,255,0),2,cv2.LINE_AA)        
-                    
-
-            # encode the frame in JPEG format
-            (flag, encodedImage) = cv2.imencode(".jpg", frame)
-            # ensure the frame was successfully encoded
-            if not flag:
-                continue
-            # yield the output frame in the byte format
-            yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
-                bytearray(encodedImage) + b'\r\n')
-            
-            time.sleep(0.4)
-            
-            
-    return StreamingResponse(generate(), media_type="multipart/x-mixed-replace; boundary=frame")
\ No newline at end of file
+async def get_video_stream_prediction():
+    # Every client shares the same encoded JPEG from the prediction broadcaster
+    return StreamingResponse(stm.subscribe("predict"), media_type="multipart/x-mixed-replace; boundary=frame")
+
+
+@app.get("/status/stream", tags=["Status"], description="Return current status of video stream broadcaster like subscriber count and dropped frames.")
+async def status_stream():
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success",
+            "message": "Return status of stream",
+            "status_stream": stm.getStatus()
+        }
+    )
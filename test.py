@@ -1,16 +1,12 @@
 from app.serimane import SeriMane
 from app.sysmane import SysMane
-import threading
 import time
 
 # Create the SysMane and SeriMane objects
 sysmane = SysMane()
 serimane = SeriMane(sysmane)
 
-# Start the obstacle detection thread
-obstacle_thread = threading.Thread(target=serimane.detectObstacle)
-obstacle_thread.daemon = True
-obstacle_thread.start()
+# The obstacle and grip sensors are watched by SeriMane itself (GPIO edge interrupts)
 
 serimane.sendMessageToArduino("PS")
 time.sleep(1)